@@ -0,0 +1,72 @@
+from ffmpeg_tools import write_concat_segments
+
+# Codecs audio copiables tels quels, avec l'extension (donc le conteneur) de sortie
+AUDIO_COPY_CONTAINERS = {
+    'aac': 'm4a',
+    'alac': 'm4a',
+    'mp3': 'mp3',
+    'opus': 'ogg',
+    'vorbis': 'ogg',
+    'flac': 'flac',
+}
+
+# Décalage maximal toléré entre une borne demandée et la frontière de paquet utilisée (secondes)
+DEFAULT_CUT_TOLERANCE = 0.05
+
+
+def _nearest_packet(media, t):
+    """Frontière de paquet la plus proche de t (None si l'index est vide)"""
+    candidates = [pts for pts in (media.packet_before(t), media.packet_after(t)) if pts is not None]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda pts: abs(pts - t))
+
+
+def plan_audio_copy(media, segments, tolerance=DEFAULT_CUT_TOLERANCE):
+    """
+    Prépare une découpe par copie de paquets pour une source audio seule.
+    Chaque borne est alignée sur la frontière de paquet la plus proche ; si un
+    alignement dépasse tolerance, retourne None (ré-encodage nécessaire).
+    """
+    stream = media.first_stream('audio')
+    if media.has_video or stream is None:
+        return None
+    extension = AUDIO_COPY_CONTAINERS.get(stream.get('codec_name'))
+    if extension is None:
+        print(f"Copie audio impossible: codec {stream.get('codec_name')} non pris en charge")
+        return None
+    # L'index de paquets doit porter sur le flux audio copié
+    if not media.has_index or media.index_stream != stream['index']:
+        print("Copie audio impossible: pas d'index des paquets audio")
+        return None
+
+    planned = []
+    max_shift = 0.0
+    for segment in segments:
+        start = _nearest_packet(media, segment['start'])
+        # Après le dernier paquet, la fin du fichier est une frontière exacte
+        end = _nearest_packet(media, segment['end']) if segment['end'] < media.duration else segment['end']
+        if start is None or end is None or end <= start:
+            return None
+        shift = max(abs(start - segment['start']), abs(end - segment['end']))
+        if shift > tolerance:
+            print(f"Copie audio impossible: borne décalée de {shift * 1000:.1f}ms (tolérance {tolerance * 1000:.1f}ms)")
+            return None
+        max_shift = max(max_shift, shift)
+        planned.append((start, end))
+
+    return {
+        "codec": stream['codec_name'],
+        "extension": extension,
+        "segments": planned,
+        "max_shift_ms": round(max_shift * 1000, 2),
+    }
+
+
+def audio_copy_command(input_path, plan, list_path, output_path):
+    """Commande ffmpeg unique : demuxer concat sur la source avec inpoint/outpoint, sans ré-encodage"""
+    write_concat_segments(input_path, plan['segments'], list_path)
+    return [
+        'ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path,
+        '-map', '0:a:0', '-c', 'copy', '-y', output_path
+    ]
@@ -0,0 +1,175 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from downloader import download_file, probe_source, DEFAULT_CONNECTIONS
+from dropbox_upload import get_client, build_filename, resolve_dropbox_path, upload_file, create_share_link
+from concurrency import estimate_encode_bytes, run_subprocess
+from filter_graph import build_multi_output_graph, valid_segments
+from intervals import extract_cut_segments, parse_cuts, invert_cuts_to_keeps, DEFAULT_MIN_GAP
+from metrics import JobMetrics
+from probe import load_or_probe
+from source_cache import SourceCache, get_source_cache
+
+
+def normalize_variants(variants):
+    """
+    Accepte {"nom": cuts, ...} ou [{"name": ..., "cuts": ..., "filename": ...}, ...]
+    et retourne une liste de dicts name/cuts/filename.
+    """
+    if isinstance(variants, dict):
+        return [{"name": name, "cuts": cuts, "filename": None} for name, cuts in variants.items()]
+    normalized = []
+    seen = set()
+    for i, variant in enumerate(variants):
+        name = variant.get('name') or f"variant_{i}"
+        if name in seen:
+            name = f"{name}_{i}"
+        seen.add(name)
+        normalized.append({
+            "name": name,
+            "cuts": variant['cuts'],
+            "filename": variant.get('filename'),
+        })
+    return normalized
+
+
+def _upload_variant(dbx, dropbox_folder, variant, output_path):
+    try:
+        dropbox_path, filename = resolve_dropbox_path(dbx, dropbox_folder, variant['filename'])
+        dropbox_path, upload_stats = upload_file(dbx, output_path, dropbox_path)
+        file_size = upload_stats['bytes']
+        return {
+            "name": variant['name'],
+            "success": True,
+            "dropbox_path": dropbox_path,
+            "filename_used": dropbox_path.split('/')[-1],
+            "download_url": create_share_link(dbx, dropbox_path),
+            "output_size_mb": round(file_size / 1024 / 1024, 2),
+            "chunks_uploaded": upload_stats['chunks'],
+            "upload": upload_stats,
+            "segments_processed": len(variant['segments']),
+            "total_duration_kept": round(sum(seg['end'] - seg['start'] for seg in variant['segments']), 2),
+        }
+    except Exception as e:
+        print(f"Erreur upload variante {variant['name']}: {e}")
+        return {"name": variant['name'], "error": str(e)}
+
+
+def _upload_variants(dbx, dropbox_folder, variants):
+    with ThreadPoolExecutor(max_workers=len(variants)) as pool:
+        return list(pool.map(
+            lambda variant: _upload_variant(dbx, dropbox_folder, variant, variant['output_path']),
+            variants
+        ))
+
+
+async def handle_batch(job_input, admission, workspace):
+    """
+    Produit plusieurs montages d'une même source : un seul téléchargement, une seule
+    sonde et une seule passe de décodage (split + select), puis uploads en parallèle.
+    Seule la commande ffmpeg passe par le contrôle d'admission (admission.slot) ; source,
+    script de filtres et sorties sont écrits dans workspace, supprimé par le handler.
+    """
+    video_url = job_input['video_url']
+    dropbox_folder = job_input.get('dropbox_folder', '/processed_videos/')
+    dropbox_token = job_input['dropbox_token']
+    min_gap = float(job_input.get('min_gap', DEFAULT_MIN_GAP))
+    download_connections = int(job_input.get('download_connections', DEFAULT_CONNECTIONS))
+    variants = normalize_variants(job_input['variants'])
+
+    print(f"Job batch: {len(variants)} variantes depuis {video_url}")
+
+    # Nom de base commun, suffixé par le nom de chaque variante
+    base_name = build_filename(job_input.get('filename')).rsplit('.', 1)[0]
+    for variant in variants:
+        variant['filename'] = build_filename(variant['filename'] or f"{base_name}_{variant['name']}")
+
+    job_metrics = JobMetrics()
+    cache_entry = None
+    try:
+        with job_metrics.stage('download'):
+            source_info = await asyncio.to_thread(probe_source, video_url)
+            if job_input.get('use_source_cache', True) and SourceCache.cacheable(source_info):
+                cache_entry, cache_stats = await asyncio.to_thread(
+                    get_source_cache().acquire, video_url, connections=download_connections, source_info=source_info
+                )
+                input_path = cache_entry.path
+            else:
+                cache_stats = None
+                input_path = os.path.join(workspace, 'source.mp4')
+                await asyncio.to_thread(
+                    download_file, video_url, input_path, connections=download_connections, source_info=source_info
+                )
+
+        with job_metrics.stage('probe'):
+            media, _ = await asyncio.to_thread(
+                load_or_probe, input_path, sidecar_path=cache_entry.index_path if cache_entry else None
+            )
+        if not media.has_video and not media.has_audio:
+            return {"error": "Aucun stream audio ou vidéo détecté"}
+
+        results = {}
+        renderable = []
+        with job_metrics.stage('intervals'):
+            for variant in variants:
+                cuts, _ = parse_cuts(extract_cut_segments(variant['cuts']))
+                if not cuts:
+                    results[variant['name']] = {"name": variant['name'], "error": "Aucun cut valide trouvé"}
+                    continue
+                variant['segments'] = invert_cuts_to_keeps(cuts, media.duration, min_gap=min_gap)
+                if not variant['segments']:
+                    results[variant['name']] = {"name": variant['name'], "error": "Aucun segment à garder après inversion"}
+                    continue
+                # Une variante sans segment exploitable ne doit pas bloquer les autres
+                variant['segments'] = valid_segments(variant['segments'])
+                if not variant['segments']:
+                    results[variant['name']] = {"name": variant['name'], "error": "Tous les segments sont trop courts après filtrage"}
+                    continue
+                variant['output_path'] = os.path.join(workspace, f"output_{len(renderable)}.mp4")
+                renderable.append(variant)
+
+        if renderable:
+            graph = build_multi_output_graph(
+                [v['segments'] for v in renderable], media.has_video, media.has_audio,
+                frame_rate=media.frame_rate, script_dir=workspace
+            )
+
+            # Une seule commande ffmpeg : une entrée décodée une fois, une sortie par variante
+            cmd = ['ffmpeg', '-i', input_path] + graph['args']
+            for variant, maps in zip(renderable, graph['output_maps']):
+                cmd += maps
+                if media.has_video:
+                    cmd += ['-c:v', 'libx264']
+                if media.has_audio:
+                    cmd += ['-c:a', 'aac']
+                cmd += ['-y', variant['output_path']]
+            kept_duration = sum(seg['end'] - seg['start'] for v in renderable for seg in v['segments'])
+            estimated_bytes = estimate_encode_bytes(os.path.getsize(input_path), kept_duration, media.duration, 'filter')
+            try:
+                # Téléchargement et uploads se chevauchent avec les autres jobs, pas l'encodage
+                async with admission.slot(estimated_bytes) as slot:
+                    job_metrics.add('encode_queue', slot.waited)
+                    with job_metrics.stage('encode'):
+                        await run_subprocess(cmd)
+            finally:
+                if graph['script_path']:
+                    os.unlink(graph['script_path'])
+
+            dbx = get_client(dropbox_token)
+            # Uploads, liens de partage compris, de toutes les variantes en parallèle
+            with job_metrics.stage('upload'):
+                for entry in await asyncio.to_thread(_upload_variants, dbx, dropbox_folder, renderable):
+                    results[entry['name']] = entry
+
+        return {
+            "success": any(entry.get('success') for entry in results.values()),
+            "message": f"{len(renderable)} variants processed from one decode pass",
+            "variants": [results[variant['name']] for variant in variants],
+            "media_type": f"video: {media.has_video}, audio: {media.has_audio}",
+            "source_cache": cache_stats,
+            "timings": job_metrics.summary(),
+        }
+    finally:
+        if cache_entry:
+            cache_entry.release()
@@ -0,0 +1,277 @@
+"""
+Benchmark de bout en bout du handler, sans URL ni token réels : médias générés
+avec les sources lavfi de ffmpeg, servis par un serveur HTTP local (Range) et
+uploadés vers le faux Dropbox. Chaque cas tourne dans un processus séparé pour
+mesurer son pic de RSS (handler et ffmpeg) et son pic d'occupation disque.
+
+Le rapport JSON (timings par étape, métriques, pics mémoire/disque) se compare
+d'un commit à l'autre.
+
+Usage: python benchmarks/bench_handler.py [--kinds av,audio,video] [--durations 30,120]
+       [--resolutions 640x360,1280x720] [--segments 1,10,100] [--fetch-mode full]
+       [--output report.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_dropbox import FakeDropbox  # noqa: E402
+from range_http_server import RangeHTTPServer  # noqa: E402
+
+DISK_SAMPLE_INTERVAL = 0.05
+
+
+def generate_media(path, kind, duration, resolution):
+    """Génère un fichier de test : vidéo+audio, audio seul ou vidéo seule"""
+    cmd = ['ffmpeg', '-v', 'quiet']
+    if kind in ('av', 'video'):
+        cmd += ['-f', 'lavfi', '-i', f"testsrc2=size={resolution}:rate=30:duration={duration}"]
+    if kind in ('av', 'audio'):
+        cmd += ['-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}"]
+    if kind in ('av', 'video'):
+        cmd += ['-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60']
+    if kind in ('av', 'audio'):
+        cmd += ['-c:a', 'aac']
+    subprocess.run(cmd + ['-shortest', '-y', path], check=True)
+
+
+def make_cuts(count, duration):
+    """count segments gardés : la seconde moitié de chaque tranche est coupée (en millisecondes)"""
+    step = duration / count
+    return {"cuts": [
+        {"start": int((i * step + step / 2) * 1000), "end": int((i + 1) * step * 1000)}
+        for i in range(count)
+    ]}
+
+
+def directory_bytes(paths):
+    """Octets réellement alloués (fichiers creux compris) sous les répertoires donnés"""
+    total = 0
+    for root_path in paths:
+        for root, _, files in os.walk(root_path):
+            for name in files:
+                try:
+                    total += os.stat(os.path.join(root, name)).st_blocks * 512
+                except OSError:
+                    pass
+    return total
+
+
+class DiskSampler:
+    """Échantillonne l'occupation disque pendant un cas et garde le pic"""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.peak = max(self.peak, directory_bytes(self.paths))
+            self.stop_event.wait(DISK_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self.peak = max(self.peak, directory_bytes(self.paths))
+
+
+def run_case(case_path, result_path):
+    """Processus enfant : un appel au handler, mesures comprises"""
+    with open(case_path) as f:
+        case = json.load(f)
+    # Les répertoires de travail sont lus à l'import des modules du handler
+    os.environ.update(case['env'])
+    import handler
+
+    event = {"input": case['input']}
+    with DiskSampler([case['env']['WORKSPACE_ROOT'], case['env']['SOURCE_CACHE_DIR']]) as disk:
+        started = time.monotonic()
+        result = asyncio.run(handler.handler(event))
+        wall = time.monotonic() - started
+
+    # ru_maxrss est en kilo-octets sous Linux
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    report = {
+        "success": bool(result.get('success')),
+        "error": result.get('error'),
+        "wall_seconds": round(wall, 3),
+        "timings": result.get('timings'),
+        "metrics": result.get('metrics'),
+        "output_size_mb": result.get('output_size_mb'),
+        "peak_rss_mb": round(self_usage.ru_maxrss / 1024, 1),
+        "peak_ffmpeg_rss_mb": round(children_usage.ru_maxrss / 1024, 1),
+        "peak_disk_mb": round(disk.peak / 1024 / 1024, 1),
+    }
+    with open(result_path, 'w') as f:
+        json.dump(report, f)
+
+
+def tool_version(tool):
+    try:
+        return subprocess.run([tool, '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    except OSError:
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kinds', default='av,audio,video')
+    parser.add_argument('--durations', default='30,120')
+    parser.add_argument('--resolutions', default='640x360,1280x720')
+    parser.add_argument('--segments', default='1,10,100')
+    parser.add_argument('--encode-mode', default='filter')
+    # Épinglé : en 'auto' le nombre de segments et la part gardée changeraient de pipeline d'un cas à l'autre
+    parser.add_argument('--fetch-mode', default='full', choices=['full', 'partial', 'auto'])
+    parser.add_argument('--extra-input', default='{}', help="options JSON ajoutées à l'input du job")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--run-case', nargs=2, metavar=('CASE', 'RESULT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(*args.run_case)
+        return
+
+    kinds = args.kinds.split(',')
+    durations = [float(d) for d in args.durations.split(',')]
+    resolutions = args.resolutions.split(',')
+    segment_counts = [int(c) for c in args.segments.split(',')]
+    extra_input = json.loads(args.extra_input)
+
+    with tempfile.TemporaryDirectory(prefix='bench_handler_') as tmp:
+        media_dir = os.path.join(tmp, 'media')
+        os.makedirs(media_dir)
+        server = RangeHTTPServer(media_dir).start()
+        fake = FakeDropbox().start()
+
+        sources = []
+        for kind in kinds:
+            # Sans vidéo, la résolution ne change rien : une seule source par durée
+            for resolution in (resolutions if kind != 'audio' else [None]):
+                for duration in durations:
+                    name = f"{kind}_{resolution or 'na'}_{int(duration)}s.{'m4a' if kind == 'audio' else 'mp4'}"
+                    path = os.path.join(media_dir, name)
+                    print(f"Génération {name}", file=sys.stderr)
+                    generate_media(path, kind, duration, resolution)
+                    sources.append({
+                        "kind": kind,
+                        "resolution": resolution,
+                        "duration": duration,
+                        "name": name,
+                        "size_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+                    })
+
+        cases = []
+        for source in sources:
+            for count in segment_counts:
+                for run in range(args.repeat):
+                    case_dir = tempfile.mkdtemp(dir=tmp)
+                    job_input = {
+                        "video_url": server.url(source['name']),
+                        "cuts": make_cuts(count, source['duration']),
+                        "dropbox_token": "bench-token",
+                        "dropbox_folder": "/bench",
+                        "filename": f"{source['name'].rsplit('.', 1)[0]}_{count}",
+                        "encode_mode": args.encode_mode,
+                        "fetch_mode": args.fetch_mode,
+                        # Téléchargement mesuré à chaque cas, sauf demande contraire
+                        "use_source_cache": False,
+                        # Les répétitions d'un même cas sont des jobs identiques : pas de résultat mémorisé
+                        "memoize": False,
+                    }
+                    job_input.update(extra_input)
+                    case = {
+                        "input": job_input,
+                        "env": {
+                            "DROPBOX_API_BASE_URL": fake.base_url,
+                            "WORKSPACE_ROOT": os.path.join(case_dir, 'jobs'),
+                            "SOURCE_CACHE_DIR": os.path.join(case_dir, 'cache'),
+                            "RESULT_STORE_DIR": os.path.join(case_dir, 'results'),
+                        },
+                    }
+                    case_path = os.path.join(case_dir, 'case.json')
+                    result_path = os.path.join(case_dir, 'result.json')
+                    with open(case_path, 'w') as f:
+                        json.dump(case, f)
+
+                    output = None if args.verbose else subprocess.DEVNULL
+                    process = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), '--run-case', case_path, result_path],
+                        stdout=output, stderr=output
+                    )
+                    if process.returncode == 0 and os.path.exists(result_path):
+                        with open(result_path) as f:
+                            result = json.load(f)
+                    else:
+                        result = {"success": False, "error": f"processus de benchmark en échec ({process.returncode})"}
+
+                    entry = {**source, "segments": count, "run": run, **result}
+                    cases.append(entry)
+                    print(json.dumps({
+                        key: entry.get(key)
+                        for key in ('name', 'segments', 'success', 'wall_seconds', 'peak_rss_mb', 'peak_disk_mb')
+                    }), file=sys.stderr)
+
+        server.stop()
+        fake.stop()
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": tool_version('ffmpeg'),
+        },
+        "parameters": {
+            "kinds": kinds,
+            "durations": durations,
+            "resolutions": resolutions,
+            "segments": segment_counts,
+            "encode_mode": args.encode_mode,
+            "fetch_mode": args.fetch_mode,
+            "extra_input": extra_input,
+            "repeat": args.repeat,
+        },
+        "cases": cases,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
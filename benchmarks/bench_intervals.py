@@ -0,0 +1,93 @@
+"""
+Microbenchmarks du module intervals de 1e2 à 1e6 cuts, comparés à l'ancienne
+inversion (logs par cut redirigés vers un tampon en mémoire).
+
+Usage: python benchmarks/bench_intervals.py [--max-exponent 6]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intervals import normalize_cuts, invert_cuts_to_keeps  # noqa: E402
+
+
+def legacy_invert_cuts_to_keeps(cuts, total_duration):
+    """Ancienne implémentation du handler, avec ses prints par cut"""
+    keeps = []
+    cuts_sorted = sorted(cuts, key=lambda x: x['start'])
+    for i, cut in enumerate(cuts_sorted):
+        print(f"Cut {i}: {cut['start']} → {cut['end']}")
+    current_pos = 0
+    for i, cut in enumerate(cuts_sorted):
+        print(f"\nTraitement cut {i}: {cut['start']} → {cut['end']}")
+        print(f"Position actuelle: {current_pos}")
+        gap_duration = cut['start'] - current_pos
+        print(f"Gap avant cut: {gap_duration}s")
+        if current_pos < cut['start'] and gap_duration > 0.1:
+            keeps.append({"start": current_pos, "end": cut['start']})
+            print(f"✓ Segment ajouté: {current_pos} → {cut['start']} (durée: {gap_duration}s)")
+        else:
+            print("✗ Gap ignoré (trop court ou négatif)")
+        current_pos = max(current_pos, cut['end'])
+        print(f"Nouvelle position: {current_pos}")
+    if current_pos < total_duration - 0.1:
+        keeps.append({"start": current_pos, "end": total_duration})
+    for i, keep in enumerate(keeps):
+        print(f"Segment {i}: {keep['start']} → {keep['end']} (durée: {keep['end'] - keep['start']}s)")
+    return keeps
+
+
+def make_cuts(count, seed=0):
+    """Cuts aléatoires non triés, avec chevauchements"""
+    rng = random.Random(seed)
+    total_duration = count * 2.0
+    cuts = []
+    for _ in range(count):
+        start = rng.uniform(0, total_duration)
+        cuts.append({"start": start, "end": start + rng.uniform(0.05, 1.5)})
+    return cuts, total_duration
+
+
+def best_of(fn, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-exponent', type=int, default=6)
+    args = parser.parse_args()
+
+    results = []
+    for exponent in range(2, args.max_exponent + 1):
+        cuts, total_duration = make_cuts(10 ** exponent)
+        sink = io.StringIO()
+        with contextlib.redirect_stdout(sink):
+            legacy = best_of(lambda: legacy_invert_cuts_to_keeps(cuts, total_duration))
+            normalize = best_of(lambda: normalize_cuts(cuts, total_duration))
+            invert = best_of(lambda: invert_cuts_to_keeps(cuts, total_duration))
+        results.append({
+            "cuts": len(cuts),
+            "legacy_s": round(legacy, 6),
+            "normalize_s": round(normalize, 6),
+            "invert_s": round(invert, 6),
+            "speedup": round(legacy / invert, 1) if invert else None,
+        })
+        print(json.dumps(results[-1]), file=sys.stderr)
+
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
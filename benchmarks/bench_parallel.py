@@ -0,0 +1,73 @@
+"""
+Compare le temps d'encodage entre le graphe de filtres unique et
+l'encodage parallèle par lots, pour 1, 10, 100 et 1000 segments.
+
+Usage: python benchmarks/bench_parallel.py [--duration 600] [--workers N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parallel_encode import parallel_encode, default_worker_count  # noqa: E402
+
+SEGMENT_COUNTS = [1, 10, 100, 1000]
+
+
+def generate_source(path, duration):
+    subprocess.run([
+        'ffmpeg', '-v', 'quiet',
+        '-f', 'lavfi', '-i', f"testsrc2=size=1280x720:rate=30:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:duration={duration}",
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac',
+        '-shortest', '-y', path
+    ], check=True)
+
+
+def make_segments(count, duration):
+    """Garde la première moitié de chaque tranche de durée égale"""
+    step = duration / count
+    return [{"start": i * step, "end": i * step + step / 2} for i in range(count)]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=600)
+    parser.add_argument('--workers', type=int, default=default_worker_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.mp4')
+        generate_source(source, args.duration)
+        output = os.path.join(tmp, 'output.mp4')
+
+        results = []
+        for count in SEGMENT_COUNTS:
+            segments = make_segments(count, args.duration)
+            # Un seul lot, un seul worker : équivalent du graphe unique du handler
+            single = timed(parallel_encode, source, segments, output, workers=1)
+            parallel = timed(parallel_encode, source, segments, output, workers=args.workers)
+            results.append({
+                "segments": count,
+                "single_graph_s": round(single, 3),
+                "parallel_s": round(parallel, 3),
+                "speedup": round(single / parallel, 2) if parallel else None,
+            })
+            print(json.dumps(results[-1]), file=sys.stderr)
+
+    print(json.dumps({"duration": args.duration, "workers": args.workers, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Mesure du démarrage à froid : temps d'import du handler (et des dépendances
+lourdes qu'il charge), puis temps jusqu'au premier job terminé en lançant
+'python handler.py --test_input ...' contre une source HTTP locale et le faux Dropbox.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--duration 10] [--output report.json]
+       (--skip-job pour ne mesurer que les imports, sans ffmpeg)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_handler import generate_media, make_cuts, git_commit  # noqa: E402
+from fake_dropbox import FakeDropbox  # noqa: E402
+from range_http_server import RangeHTTPServer  # noqa: E402
+
+HEAVY_MODULES = ['runpod', 'dropbox', 'requests']
+
+
+def import_profile(module):
+    """Lance 'python -X importtime' et retourne (durée cumulée du module, modules lourds chargés en µs)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = [part.strip() for part in line[len('import time:'):].split('|')]
+        if parts[1].isdigit():
+            cumulative[parts[2]] = int(parts[1])
+    heavy = {name: cumulative[name] for name in HEAVY_MODULES if name in cumulative}
+    return cumulative.get(module), heavy
+
+
+def measure_imports(runs):
+    samples = []
+    heavy = {}
+    for _ in range(runs):
+        started = time.monotonic()
+        subprocess.run([sys.executable, '-c', 'import handler'], cwd=REPO_DIR, check=True)
+        samples.append(time.monotonic() - started)
+    handler_us, heavy = import_profile('handler')
+    return {
+        "process_seconds_median": round(statistics.median(samples), 3),
+        "process_seconds": [round(sample, 3) for sample in samples],
+        "handler_import_ms": round(handler_us / 1000, 1) if handler_us else None,
+        # Vide si les dépendances lourdes sont bien différées
+        "heavy_modules_at_import_ms": {name: round(us / 1000, 1) for name, us in heavy.items()},
+        "runpod_import_ms": round(import_profile('runpod')[0] / 1000, 1),
+    }
+
+
+def measure_first_job(runs, duration):
+    with tempfile.TemporaryDirectory(prefix='bench_startup_') as tmp:
+        media_dir = os.path.join(tmp, 'media')
+        os.makedirs(media_dir)
+        generate_media(os.path.join(media_dir, 'source.mp4'), 'av', duration, '640x360')
+        server = RangeHTTPServer(media_dir).start()
+        fake = FakeDropbox().start()
+
+        samples = []
+        for run in range(runs):
+            run_dir = tempfile.mkdtemp(dir=tmp)
+            job = {"input": {
+                "video_url": server.url('source.mp4'),
+                "cuts": make_cuts(5, duration),
+                "dropbox_token": "bench-token",
+                "dropbox_folder": "/startup",
+                "use_source_cache": False,
+                "memoize": False,
+            }}
+            env = dict(
+                os.environ,
+                DROPBOX_API_BASE_URL=fake.base_url,
+                WORKSPACE_ROOT=os.path.join(run_dir, 'jobs'),
+                SOURCE_CACHE_DIR=os.path.join(run_dir, 'cache'),
+                RESULT_STORE_DIR=os.path.join(run_dir, 'results'),
+            )
+            started = time.monotonic()
+            process = subprocess.run(
+                [sys.executable, 'handler.py', '--test_input', json.dumps(job)],
+                cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            elapsed = time.monotonic() - started
+            samples.append({"run": run, "seconds": round(elapsed, 3), "success": process.returncode == 0})
+            print(json.dumps(samples[-1]), file=sys.stderr)
+
+        server.stop()
+        fake.stop()
+
+    succeeded = [sample['seconds'] for sample in samples if sample['success']]
+    return {
+        "source_duration": duration,
+        "seconds_median": round(statistics.median(succeeded), 3) if succeeded else None,
+        "runs": samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--skip-job', action='store_true')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": sys.version.split()[0],
+        "imports": measure_imports(args.runs),
+        "time_to_first_job": None if args.skip_job else measure_first_job(args.runs, args.duration),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
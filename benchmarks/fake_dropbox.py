@@ -0,0 +1,218 @@
+"""
+Faux Dropbox local pour tester et mesurer le chemin d'upload sans token réel.
+
+Implémente les routes utilisées par le handler (upload, sessions d'upload,
+get_metadata, list_folder, create_shared_link). Les fichiers sont gardés en mémoire.
+rate_limit_every=N renvoie un 429 (Retry-After: 0) toutes les N requêtes,
+drop_every=N coupe la connexion sans réponse sur un append sur N (après l'avoir
+enregistré, comme une réponse perdue).
+Utilisation : lancer FakeDropbox().start() puis exporter
+DROPBOX_API_BASE_URL=<fake.base_url> avant d'appeler le handler.
+"""
+import json
+import socket
+import threading
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeDropboxState:
+    def __init__(self, rate_limit_every=0, drop_every=0):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.ids = {}
+        self.sessions = {}
+        self.calls = []
+        self.rate_limit_every = rate_limit_every
+        self.rate_limited = 0
+        self.drop_every = drop_every
+        self.appends = 0
+        self.dropped = 0
+
+    def record(self, route):
+        """Enregistre l'appel, retourne True s'il doit être rejeté en 429"""
+        with self.lock:
+            self.calls.append(route)
+            if self.rate_limit_every and len(self.calls) % self.rate_limit_every == 0:
+                self.rate_limited += 1
+                return True
+            return False
+
+    def commit(self, path, data, autorename=True):
+        """Enregistre un fichier en appliquant le renommage automatique 'name (1).ext'"""
+        with self.lock:
+            final_path = path
+            counter = 1
+            while final_path.lower() in self.files and autorename:
+                base, dot, ext = path.rpartition('.')
+                final_path = f"{base} ({counter}).{ext}" if dot else f"{path} ({counter})"
+                counter += 1
+            self.files[final_path.lower()] = (final_path, bytes(data))
+            # Nouvel id à chaque fichier écrit, stable tant qu'il n'est pas remplacé
+            self.ids[final_path.lower()] = f"id:{uuid.uuid4().hex[:16]}"
+            return final_path, len(data)
+
+
+def file_metadata(path, size, file_id=None):
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return {
+        ".tag": "file",
+        "name": path.rsplit('/', 1)[-1],
+        "id": file_id or f"id:{uuid.uuid4().hex[:16]}",
+        "client_modified": now,
+        "server_modified": now,
+        "rev": "0123456789abcdef",
+        "size": size,
+        "path_lower": path.lower(),
+        "path_display": path,
+        "is_downloadable": True,
+    }
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _route_error(self, summary, error):
+            self._send_json(409, {"error_summary": summary, "error": error})
+
+        def do_POST(self):
+            route = self.path.split('/2/', 1)[-1]
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            if state.record(route):
+                self.send_response(429)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            header_arg = self.headers.get('Dropbox-API-Arg')
+            arg = json.loads(header_arg) if header_arg else (json.loads(body) if body else {})
+            handler = getattr(self, 'route_' + route.replace('/', '_'), None)
+            if handler is None:
+                self._send_json(404, {"error_summary": f"unknown route {route}"})
+                return
+            handler(arg, body)
+
+        def route_files_upload(self, arg, body):
+            path, size = state.commit(arg['path'], body, arg.get('autorename', False))
+            self._send_json(200, file_metadata(path, size, state.ids.get(path.lower())))
+
+        def route_files_upload_session_start(self, arg, body):
+            session_id = uuid.uuid4().hex
+            with state.lock:
+                state.sessions[session_id] = {
+                    "concurrent": (arg.get('session_type') or {}).get('.tag') == 'concurrent',
+                    "chunks": {0: body},
+                }
+            self._send_json(200, {"session_id": session_id})
+
+        def route_files_upload_session_append_v2(self, arg, body):
+            cursor = arg['cursor']
+            with state.lock:
+                session = state.sessions.get(cursor['session_id'])
+                if session is None:
+                    self._route_error("not_found/", {".tag": "not_found"})
+                    return
+                if session['concurrent'] and not arg.get('close') and len(body) % (4 * 1024 * 1024):
+                    self._route_error("invalid_chunk_size/", {".tag": "invalid_chunk_size"})
+                    return
+                session['chunks'][cursor['offset']] = body
+                state.appends += 1
+                drop = state.drop_every and state.appends % state.drop_every == 0
+                if drop:
+                    state.dropped += 1
+            if drop:
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            self._send_json(200, None)
+
+        def route_files_upload_session_finish(self, arg, body):
+            cursor = arg['cursor']
+            with state.lock:
+                session = state.sessions.pop(cursor['session_id'], None)
+            if session is None:
+                self._route_error("lookup_failed/not_found/", {".tag": "lookup_failed", "lookup_failed": {".tag": "not_found"}})
+                return
+            chunks = session['chunks']
+            chunks[cursor['offset']] = body
+            data = b''.join(chunks[offset] for offset in sorted(chunks))
+            commit = arg['commit']
+            path, size = state.commit(commit['path'], data, commit.get('autorename', False))
+            self._send_json(200, file_metadata(path, size, state.ids.get(path.lower())))
+
+        def route_files_get_metadata(self, arg, body):
+            with state.lock:
+                entry = state.files.get(arg['path'].lower())
+            if entry is None:
+                self._route_error("path/not_found/", {".tag": "path", "path": {".tag": "not_found"}})
+                return
+            self._send_json(200, file_metadata(entry[0], len(entry[1]), state.ids.get(entry[0].lower())))
+
+        def route_files_list_folder(self, arg, body):
+            folder = arg['path'].rstrip('/').lower()
+            with state.lock:
+                entries = [
+                    file_metadata(path, len(data), state.ids.get(path.lower()))
+                    for path, data in state.files.values()
+                    if path.lower().rsplit('/', 1)[0] == folder
+                ]
+            if not entries and folder:
+                self._route_error("path/not_found/", {".tag": "path", "path": {".tag": "not_found"}})
+                return
+            limit = arg.get('limit') or len(entries)
+            self._send_json(200, {
+                "entries": entries[:limit],
+                "cursor": uuid.uuid4().hex,
+                "has_more": len(entries) > limit,
+            })
+
+        def route_sharing_create_shared_link(self, arg, body):
+            self._send_json(200, {
+                "url": f"https://fake.dropbox.local/s/{uuid.uuid4().hex[:12]}{arg['path']}?dl=0",
+                "visibility": {".tag": "public"},
+                "path": arg['path'],
+            })
+
+    return Handler
+
+
+class FakeDropbox:
+    def __init__(self, host='127.0.0.1', port=0, rate_limit_every=0, drop_every=0):
+        self.state = FakeDropboxState(rate_limit_every, drop_every)
+        self.server = ThreadingHTTPServer((host, port), make_handler(self.state))
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    fake = FakeDropbox(port=8765).start()
+    print(f"Faux Dropbox sur {fake.base_url}")
+    fake.thread.join()
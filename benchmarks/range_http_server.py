@@ -0,0 +1,129 @@
+"""
+Serveur HTTP local servant un répertoire avec support des requêtes Range,
+pour tester le téléchargeur et le mode partial fetch sans source distante.
+
+Options utiles aux tests : no_ranges (serveur sans Range) et fail_every
+(coupe la connexion tous les N octets envoyés pour tester la reprise).
+"""
+import os
+import re
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    no_ranges = False
+    fail_every = None
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _file_headers(self, path, size):
+        stat = os.stat(path)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('ETag', f'"{stat.st_ino:x}-{stat.st_size:x}-{int(stat.st_mtime):x}"')
+        self.send_header('Last-Modified', self.date_time_string(int(stat.st_mtime)))
+        if not self.no_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+
+    def _resolve(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None, None
+        return path, os.path.getsize(path)
+
+    def do_HEAD(self):
+        path, size = self._resolve()
+        if path is None:
+            return
+        self.send_response(200)
+        self._file_headers(path, size)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+
+    def do_GET(self):
+        path, size = self._resolve()
+        if path is None:
+            return
+        if self.stats is not None:
+            with self.stats['lock']:
+                self.stats['requests'] += 1
+        start, end = 0, size - 1
+        match = RANGE_PATTERN.fullmatch(self.headers.get('Range', '').strip())
+        if match and not self.no_ranges:
+            if match.group(1):
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            end = min(end, size - 1)
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        length = end - start + 1
+        self._file_headers(path, size)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while sent < length:
+                data = f.read(min(256 * 1024, length - sent))
+                if not data:
+                    break
+                if self.fail_every and sent + len(data) > self.fail_every:
+                    # Coupure simulée au milieu de la réponse
+                    self.wfile.write(data[:self.fail_every - sent])
+                    self._count(self.fail_every - sent)
+                    self.close_connection = True
+                    return
+                self.wfile.write(data)
+                sent += len(data)
+                self._count(len(data))
+
+    def _count(self, sent):
+        if self.stats is not None:
+            with self.stats['lock']:
+                self.stats['bytes_sent'] += sent
+
+
+class RangeHTTPServer:
+    def __init__(self, directory, host='127.0.0.1', port=0, no_ranges=False, fail_every=None):
+        self.stats = {'lock': threading.Lock(), 'bytes_sent': 0, 'requests': 0}
+        handler = type('Handler', (RangeRequestHandler,), {
+            'no_ranges': no_ranges,
+            'fail_every': fail_every,
+            'stats': self.stats,
+        })
+
+        def factory(*args, **kwargs):
+            return handler(*args, directory=directory, **kwargs)
+
+        self.server = ThreadingHTTPServer((host, port), factory)
+        self.thread = None
+
+    def url(self, filename):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/{filename}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
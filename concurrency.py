@@ -0,0 +1,139 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+# Nombre de jobs acceptés en même temps par un worker (la plupart attendent le réseau)
+MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', 4))
+
+# Cœurs réservés à chaque encodage libx264
+CPUS_PER_ENCODE = int(os.environ.get('CPUS_PER_ENCODE', 4))
+
+# Espace disque gardé libre en plus des besoins estimés des encodages en cours
+DISK_RESERVE_BYTES = int(os.environ.get('DISK_RESERVE_BYTES', 1024 ** 3))
+
+WORKSPACE_ROOT = os.environ.get('WORKSPACE_ROOT', os.path.join(tempfile.gettempdir(), 'jobs'))
+
+
+def estimate_encode_bytes(source_bytes, kept_duration, total_duration, encode_mode):
+    """Estimation grossière de l'espace disque nécessaire à l'encodage"""
+    ratio = kept_duration / total_duration if total_duration else 1
+    # Smart cut et encodage parallèle écrivent des morceaux intermédiaires en plus de la sortie
+    factor = 2.4 if encode_mode in ('smart', 'parallel') else 1.2
+    return int(source_bytes * ratio * factor)
+
+
+def concurrency_modifier(current_concurrency):
+    """Appelé par RunPod pour savoir combien de jobs ce worker peut traiter en parallèle"""
+    return MAX_CONCURRENT_JOBS
+
+
+def create_workspace(job_id=None):
+    """Répertoire isolé par job : aucun chemin de sortie partagé entre jobs concurrents"""
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    prefix = f"job_{job_id}_" if job_id else "job_"
+    return tempfile.mkdtemp(prefix=prefix, dir=WORKSPACE_ROOT)
+
+
+class EncodeAdmission:
+    """
+    Contrôle d'admission des encodages : au plus cpu_count // CPUS_PER_ENCODE encodages
+    simultanés, et seulement si le disque libre couvre la sortie estimée. Les étapes
+    réseau (téléchargement, upload) ne passent pas par ici et continuent de se chevaucher.
+    """
+
+    def __init__(self, max_encodes=None, disk_path=None, reserve_bytes=DISK_RESERVE_BYTES):
+        self.max_encodes = max_encodes or max(1, (os.cpu_count() or 1) // CPUS_PER_ENCODE)
+        self.disk_path = disk_path or WORKSPACE_ROOT
+        self.reserve_bytes = reserve_bytes
+        self.active = 0
+        self.reserved_bytes = 0
+        self._condition = None
+
+    @property
+    def condition(self):
+        # Créée à la première utilisation pour être liée à la boucle asyncio de RunPod
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _free_bytes(self):
+        os.makedirs(self.disk_path, exist_ok=True)
+        return shutil.disk_usage(self.disk_path).free
+
+    def _can_admit(self, estimated_bytes):
+        if self.active >= self.max_encodes:
+            return False
+        # Toujours admettre un encodage seul, même si l'estimation dépasse le disque libre
+        if self.active == 0:
+            return True
+        return self._free_bytes() - self.reserved_bytes - estimated_bytes >= self.reserve_bytes
+
+    def slot(self, estimated_bytes=0):
+        return _EncodeSlot(self, estimated_bytes)
+
+
+class _EncodeSlot:
+    def __init__(self, admission, estimated_bytes):
+        self.admission = admission
+        self.estimated_bytes = estimated_bytes
+        self.waited = 0
+
+    @property
+    def cpus(self):
+        """Part des cœurs accordée à cet encodage"""
+        return max(1, (os.cpu_count() or 1) // self.admission.max_encodes)
+
+    async def __aenter__(self):
+        admission = self.admission
+        started = time.monotonic()
+        async with admission.condition:
+            if not admission._can_admit(self.estimated_bytes):
+                print(f"Encodage en attente ({admission.active}/{admission.max_encodes} en cours)")
+            # Réévalue périodiquement : le disque peut se libérer hors de ce contrôleur
+            while not admission._can_admit(self.estimated_bytes):
+                try:
+                    await asyncio.wait_for(admission.condition.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+            admission.active += 1
+            admission.reserved_bytes += self.estimated_bytes
+        self.waited = time.monotonic() - started
+        return self
+
+    async def __aexit__(self, *exc):
+        admission = self.admission
+        async with admission.condition:
+            admission.active -= 1
+            admission.reserved_bytes -= self.estimated_bytes
+            admission.condition.notify_all()
+        return False
+
+
+async def run_subprocess(cmd, on_stdout_line=None):
+    """
+    Lance ffmpeg/ffprobe sans bloquer la boucle asyncio, lève une erreur en cas d'échec.
+    Si on_stdout_line est fourni, stdout est lu ligne par ligne (ex: sortie de -progress).
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    if on_stdout_line is None:
+        stdout, stderr = await process.communicate()
+        stdout = stdout.decode(errors='replace')
+    else:
+        async def read_stdout():
+            lines = []
+            async for line in process.stdout:
+                line = line.decode(errors='replace')
+                on_stdout_line(line)
+                lines.append(line)
+            return ''.join(lines)
+
+        # stderr est vidé en parallèle pour que ffmpeg ne bloque pas sur un pipe plein
+        stdout, stderr = await asyncio.gather(read_stdout(), process.stderr.read())
+        await process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"{cmd[0]} failed: {stderr.decode(errors='replace')}")
+    return stdout
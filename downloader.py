@@ -0,0 +1,201 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy import lazy_import
+from logs import debug
+
+# Importés à la première requête, pas au démarrage du worker
+requests = lazy_import('requests')
+urllib3 = lazy_import('urllib3')
+
+DEFAULT_CONNECTIONS = 8
+
+# En dessous de cette taille une seule connexion suffit
+MIN_RANGE_SIZE = 8 * 1024 * 1024
+
+MIN_BUFFER_SIZE = 64 * 1024
+MAX_BUFFER_SIZE = 4 * 1024 * 1024
+
+MAX_RETRIES = 5
+REQUEST_TIMEOUT = 30
+
+
+def network_errors():
+    """Erreurs réseau après lesquelles une plage est reprise à l'offset atteint"""
+    return (requests.RequestException, urllib3.exceptions.HTTPError, OSError)
+
+
+def probe_source(url, session=None):
+    """
+    Récupère la taille, le support des Range et les validateurs (ETag, Last-Modified) de la source.
+    Essaie HEAD puis une requête GET sur le premier octet si le serveur ne répond pas à HEAD.
+    """
+    session = session or requests
+    info = {"size": None, "accept_ranges": False, "etag": None, "last_modified": None}
+    try:
+        response = session.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+        if response.ok:
+            if response.headers.get('Content-Length'):
+                info["size"] = int(response.headers['Content-Length'])
+            info["accept_ranges"] = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            info["etag"] = response.headers.get('ETag')
+            info["last_modified"] = response.headers.get('Last-Modified')
+    except requests.RequestException as e:
+        debug(f"HEAD impossible sur la source: {e}")
+
+    if not info["accept_ranges"] or info["size"] is None:
+        # Certains serveurs ne déclarent pas Accept-Ranges mais répondent 206
+        try:
+            with session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                content_range = response.headers.get('Content-Range', '')
+                if response.status_code == 206 and '/' in content_range:
+                    total = content_range.rsplit('/', 1)[1]
+                    if total.isdigit():
+                        info["size"] = int(total)
+                        info["accept_ranges"] = True
+                info["etag"] = info["etag"] or response.headers.get('ETag')
+                info["last_modified"] = info["last_modified"] or response.headers.get('Last-Modified')
+        except requests.RequestException as e:
+            debug(f"Sonde Range impossible sur la source: {e}")
+    return info
+
+
+def split_ranges(size, connections):
+    """Découpe [0, size[ en au plus 'connections' plages contiguës d'au moins MIN_RANGE_SIZE"""
+    count = max(1, min(connections, size // MIN_RANGE_SIZE))
+    step = -(-size // count)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+class _RangeWriter:
+    """Écrit une plage d'octets dans le fichier préalloué, avec reprise à l'offset atteint"""
+
+    def __init__(self, session, url, fd, start, end):
+        self.session = session
+        self.url = url
+        self.fd = fd
+        self.position = start
+        self.end = end
+        self.retries = 0
+        self.buffer_size = MIN_BUFFER_SIZE
+
+    def run(self):
+        while self.position <= self.end:
+            try:
+                self._fetch()
+            except network_errors() as e:
+                self.retries += 1
+                if self.retries > MAX_RETRIES:
+                    raise
+                delay = min(2 ** self.retries * 0.25, 10)
+                print(f"Plage {self.position}-{self.end} interrompue ({e}), reprise dans {delay}s")
+                time.sleep(delay)
+        return self.retries
+
+    def _fetch(self):
+        headers = {'Range': f"bytes={self.position}-{self.end}"}
+        with self.session.get(self.url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise requests.RequestException(f"Range ignoré par le serveur (HTTP {response.status_code})")
+            while self.position <= self.end:
+                started = time.monotonic()
+                data = response.raw.read(min(self.buffer_size, self.end - self.position + 1))
+                if not data:
+                    raise requests.RequestException("Connexion fermée avant la fin de la plage")
+                os.pwrite(self.fd, data, self.position)
+                self.position += len(data)
+                self._adapt_buffer(len(data), time.monotonic() - started)
+
+    def _adapt_buffer(self, read_size, elapsed):
+        # Buffer plein et lu rapidement : on double, lecture lente : on réduit
+        if read_size == self.buffer_size and elapsed < 0.05:
+            self.buffer_size = min(self.buffer_size * 2, MAX_BUFFER_SIZE)
+        elif elapsed > 0.5:
+            self.buffer_size = max(self.buffer_size // 2, MIN_BUFFER_SIZE)
+
+
+def _download_single(session, url, dest_path, accept_ranges):
+    """Téléchargement sur un seul flux, avec reprise si le serveur supporte les Range"""
+    retries = 0
+    position = 0
+    buffer_size = MIN_BUFFER_SIZE
+    with open(dest_path, 'wb') as f:
+        while True:
+            headers = {'Range': f"bytes={position}-"} if position and accept_ranges else {}
+            try:
+                with session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                    response.raise_for_status()
+                    if position and response.status_code != 206:
+                        # Pas de reprise possible : on repart de zéro
+                        position = 0
+                        f.seek(0)
+                        f.truncate()
+                    for chunk in response.iter_content(chunk_size=buffer_size):
+                        f.write(chunk)
+                        position += len(chunk)
+                        if len(chunk) == buffer_size:
+                            buffer_size = min(buffer_size * 2, MAX_BUFFER_SIZE)
+                return position, retries
+            except network_errors() as e:
+                retries += 1
+                if retries > MAX_RETRIES:
+                    raise
+                print(f"Téléchargement interrompu à {position} octets ({e}), nouvelle tentative")
+                time.sleep(min(2 ** retries * 0.25, 10))
+
+
+def download_file(url, dest_path, connections=DEFAULT_CONNECTIONS, source_info=None):
+    """
+    Télécharge url vers dest_path, en plusieurs plages parallèles si le serveur
+    supporte les Range, sinon sur un seul flux. Retourne les statistiques du téléchargement.
+    source_info (résultat de probe_source déjà obtenu par l'appelant) évite une nouvelle sonde.
+    """
+    started = time.monotonic()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(connections, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    try:
+        info = source_info or probe_source(url, session)
+        size = info["size"]
+        if info["accept_ranges"] and size and connections > 1 and size >= 2 * MIN_RANGE_SIZE:
+            ranges = split_ranges(size, connections)
+            print(f"Téléchargement parallèle: {size} octets en {len(ranges)} plages")
+            fd = os.open(dest_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                # Préallocation pour que les écritures positionnées ne fragmentent pas le fichier
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(fd, 0, size)
+                else:
+                    os.ftruncate(fd, size)
+                writers = [_RangeWriter(session, url, fd, start, end) for start, end in ranges]
+                with ThreadPoolExecutor(max_workers=len(writers)) as pool:
+                    retries = sum(pool.map(lambda writer: writer.run(), writers))
+            finally:
+                os.close(fd)
+            mode = "ranges"
+            downloaded = size
+        else:
+            print("Téléchargement sur un seul flux")
+            downloaded, retries = _download_single(session, url, dest_path, info["accept_ranges"])
+            ranges = [(0, downloaded - 1)]
+            mode = "single"
+    finally:
+        session.close()
+
+    elapsed = time.monotonic() - started
+    throughput = downloaded / elapsed / 1024 / 1024 if elapsed > 0 else 0
+    print(f"Téléchargé {downloaded} octets en {elapsed:.2f}s ({throughput:.1f} MB/s)")
+    return {
+        "mode": mode,
+        "bytes": downloaded,
+        "connections": len(ranges),
+        "retries": retries,
+        "seconds": round(elapsed, 3),
+        "throughput_mbps": round(throughput, 2),
+        "etag": info["etag"],
+        "last_modified": info["last_modified"],
+    }
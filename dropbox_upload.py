@@ -0,0 +1,425 @@
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from queue import Queue
+
+from downloader import network_errors
+from lazy import lazy_import
+from logs import debug
+
+# SDK volumineux (types stone générés) : importé au premier appel Dropbox
+dropbox = lazy_import('dropbox')
+
+# Upload par chunks pour gros fichiers
+CHUNK_SIZE = 4 * 1024 * 1024  # 4MB par chunk
+
+# Limite de l'API par requête (150MB), arrondie au multiple de 4MB exigé par les sessions concurrentes
+MAX_CHUNK_SIZE = 148 * 1024 * 1024
+
+# Chunks envoyés en parallèle dans une session concurrente
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))
+
+# Mémoire maximale occupée par les chunks en vol, tous workers confondus
+UPLOAD_MEMORY_BUDGET = int(os.environ.get('UPLOAD_MEMORY_BUDGET', 256 * 1024 * 1024))
+
+# Réessais d'un chunk à son offset, puis passes de reprise de la session entière
+UPLOAD_RETRIES = 4
+RESUME_PASSES = 2
+RESUME_DELAY = 5
+
+# Nombre de chunks en attente entre l'encodeur et l'uploader (mémoire bornée)
+STREAM_RING_SIZE = 4
+
+# Options mp4 fragmenté : le fichier est lisible sans revenir en arrière pour écrire le moov
+FRAGMENTED_MP4_ARGS = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4']
+
+# Connexions keep-alive par client (uploads de variantes et chunks en parallèle)
+POOL_CONNECTIONS = 16
+
+# Clients gardés en cache (un par token)
+MAX_POOLED_CLIENTS = 8
+
+# Réessais sur 429 : le SDK attend le délai Retry-After renvoyé par Dropbox
+RATE_LIMIT_RETRIES = int(os.environ.get('DROPBOX_RATE_LIMIT_RETRIES', 8))
+
+# Entrées lues en un seul appel pour détecter les noms déjà pris
+LISTING_LIMIT = 2000
+
+
+def retryable_errors():
+    """Erreurs transitoires : réseau, ou 5xx persistant après les réessais du SDK"""
+    return network_errors() + (dropbox.exceptions.InternalServerError,)
+
+
+def make_client(dropbox_token, session=None):
+    """Crée le client Dropbox, redirigé vers DROPBOX_API_BASE_URL si défini (faux Dropbox local)"""
+    dbx = dropbox.Dropbox(
+        dropbox_token,
+        session=session or dropbox.create_session(max_connections=POOL_CONNECTIONS),
+        max_retries_on_rate_limit=RATE_LIMIT_RETRIES,
+    )
+    base_url = os.environ.get('DROPBOX_API_BASE_URL')
+    if base_url:
+        base_url = base_url.rstrip('/')
+        dbx._get_route_url = lambda hostname, route_name: f"{base_url}/2/{route_name}"
+    return dbx
+
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+# Session ouverte par le warm-up, donnée au premier client créé
+_spare_session = None
+
+
+def warm_up_session():
+    """Importe le SDK et ouvre une connexion keep-alive vers l'API avant le premier job"""
+    global _spare_session
+    session = dropbox.create_session(max_connections=POOL_CONNECTIONS)
+    base_url = os.environ.get('DROPBOX_API_BASE_URL', 'https://api.dropboxapi.com').rstrip('/')
+    try:
+        # Le code de réponse importe peu : seule la connexion TLS établie est réutilisée
+        session.head(base_url, timeout=10)
+    except network_errors() as e:
+        debug(f"Warm-up Dropbox sans connexion: {e}")
+    with _clients_lock:
+        if _spare_session is None:
+            _spare_session = session
+
+
+def get_client(dropbox_token):
+    """
+    Client Dropbox mis en cache par token : les connexions keep-alive (et leurs
+    handshakes TLS) sont réutilisées entre les appels et les invocations d'un worker chaud.
+    """
+    key = hashlib.sha256(dropbox_token.encode()).hexdigest()
+    with _clients_lock:
+        dbx = _clients.get(key)
+        if dbx is not None:
+            _clients.move_to_end(key)
+            return dbx
+        global _spare_session
+        dbx = make_client(dropbox_token, session=_spare_session)
+        _spare_session = None
+        _clients[key] = dbx
+        # Les tokens courts se renouvellent : on ne garde que les plus récents
+        while len(_clients) > MAX_POOLED_CLIENTS:
+            _, evicted = _clients.popitem(last=False)
+            evicted.close()
+        return dbx
+
+
+def build_filename(custom_filename=None, extension='mp4'):
+    """Génération de nom de fichier sécurisé"""
+    if custom_filename:
+        safe_filename = re.sub(r'[<>:"/\\|?*]', '_', custom_filename)
+        if not safe_filename.lower().endswith(f'.{extension}'):
+            return f"{safe_filename}.{extension}"
+        return safe_filename
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"video_cut_{timestamp}.{extension}"
+
+
+def resolve_dropbox_path(dbx, dropbox_folder, filename):
+    """
+    Choisit un nom libre (_1, _2...) à partir d'un seul listing du dossier.
+    Si le dossier dépasse une page de listing, le nom est gardé tel quel et
+    l'autorename de Dropbox règle un éventuel conflit à l'écriture.
+    """
+    folder = dropbox_folder.rstrip('/')
+    try:
+        listing = dbx.files_list_folder(folder, limit=LISTING_LIMIT)
+        existing = {entry.name.lower() for entry in listing.entries}
+        complete = not listing.has_more
+    except dropbox.exceptions.ApiError:
+        # Dossier inexistant : il sera créé par l'upload
+        existing = set()
+        complete = True
+
+    name_part, dot, extension = filename.rpartition('.')
+    if not dot:
+        name_part, extension = filename, 'mp4'
+    candidate = filename
+    counter = 1
+    while candidate.lower() in existing:
+        candidate = f"{name_part}_{counter}.{extension}"
+        counter += 1
+    if candidate != filename:
+        print(f"Fichier existant détecté, nouveau nom: {candidate}")
+    if not complete:
+        print("Dossier volumineux, conflits éventuels délégués à l'autorename Dropbox")
+    print(f"Nom de fichier final: {candidate}")
+    return f"{folder}/{candidate}", candidate
+
+
+def _commit_info(dropbox_path):
+    return dropbox.files.CommitInfo(
+        path=dropbox_path,
+        mode=dropbox.files.WriteMode.add,
+        autorename=True
+    )
+
+
+def choose_chunk_size(file_size, workers=UPLOAD_WORKERS):
+    """
+    Taille de chunk adaptée au fichier : environ quatre chunks par worker pour équilibrer
+    la charge, en multiple de 4MB, bornée par la limite de l'API et le budget mémoire.
+    """
+    target = file_size // (workers * 4)
+    ceiling = min(MAX_CHUNK_SIZE, max(CHUNK_SIZE, UPLOAD_MEMORY_BUDGET // workers))
+    chunk_size = -(-target // CHUNK_SIZE) * CHUNK_SIZE
+    return min(max(chunk_size, CHUNK_SIZE), ceiling // CHUNK_SIZE * CHUNK_SIZE)
+
+
+def _upload_stats(mode, total_bytes, chunk_count, chunk_size, workers, retries, started):
+    elapsed = time.monotonic() - started
+    throughput = total_bytes / elapsed / 1024 / 1024 if elapsed > 0 else 0
+    print(f"Uploadé {total_bytes} octets en {elapsed:.2f}s ({throughput:.1f} MB/s, {retries} réessais)")
+    return {
+        "mode": mode,
+        "bytes": total_bytes,
+        "chunks": chunk_count,
+        "chunk_size": chunk_size,
+        "workers": workers,
+        "retries": retries,
+        "seconds": round(elapsed, 3),
+        "throughput_mbps": round(throughput, 2),
+    }
+
+
+def _already_appended(error, end_offset):
+    """Un chunk renvoyé après une réponse perdue : Dropbox indique qu'il a déjà été reçu"""
+    error = error.error
+    if not (isinstance(error, dropbox.files.UploadSessionAppendError) and error.is_incorrect_offset()):
+        return False
+    return error.get_incorrect_offset().correct_offset >= end_offset
+
+
+def _append_chunk(dbx, session_id, offset, data, close=False, retry_log=None):
+    """Envoie un chunk à son offset, en le réessayant sur erreur transitoire"""
+    cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=offset)
+    attempt = 0
+    while True:
+        try:
+            dbx.files_upload_session_append_v2(data, cursor, close=close)
+            return
+        except dropbox.exceptions.ApiError as e:
+            if attempt and _already_appended(e, offset + len(data)):
+                return
+            raise
+        except retryable_errors() as e:
+            attempt += 1
+            if retry_log is not None:
+                retry_log.append(offset)
+            if attempt > UPLOAD_RETRIES:
+                raise
+            delay = min(2 ** attempt * 0.25, 10)
+            print(f"Chunk à l'offset {offset} interrompu ({e}), nouvel envoi dans {delay}s")
+            time.sleep(delay)
+
+
+def _retry_call(description, call, *args, **kwargs):
+    """Appel Dropbox unique (upload direct, validation de session) réessayé sur erreur transitoire"""
+    attempt = 0
+    while True:
+        try:
+            return call(*args, **kwargs)
+        except retryable_errors() as e:
+            attempt += 1
+            if attempt > UPLOAD_RETRIES:
+                raise
+            delay = min(2 ** attempt * 0.25, 10)
+            print(f"{description} interrompu ({e}), nouvel essai dans {delay}s")
+            time.sleep(delay)
+
+
+def upload_file(dbx, local_path, dropbox_path, workers=UPLOAD_WORKERS):
+    """
+    Upload d'un fichier local, direct ou par session concurrente : les chunks sont lus
+    avec pread et envoyés en parallèle, chacun réessayé à son offset ; les chunks encore
+    en échec sont renvoyés dans la même session (reprise). Retourne (chemin final, statistiques).
+    """
+    started = time.monotonic()
+    file_size = os.path.getsize(local_path)
+
+    if file_size <= CHUNK_SIZE:
+        print("Upload direct (fichier < 4MB)")
+        with open(local_path, 'rb') as f:
+            data = f.read()
+        result_upload = _retry_call(
+            "Upload direct", dbx.files_upload,
+            data,
+            dropbox_path,
+            mode=dropbox.files.WriteMode.add,
+            autorename=True
+        )
+        return result_upload.path_display, _upload_stats('direct', file_size, 1, file_size, 1, 0, started)
+
+    chunk_size = choose_chunk_size(file_size, workers)
+    chunks = [(offset, min(chunk_size, file_size - offset)) for offset in range(0, file_size, chunk_size)]
+    print(f"Upload par chunks ({file_size} bytes, {len(chunks)} chunks de {chunk_size} bytes, {workers} en parallèle)")
+
+    session = dbx.files_upload_session_start(b'', session_type=dropbox.files.UploadSessionType.concurrent)
+    session_id = session.session_id
+    print(f"Session démarrée: {session_id}")
+
+    retry_log = []
+    fd = os.open(local_path, os.O_RDONLY)
+
+    def send(chunk, close=False):
+        offset, length = chunk
+        # pread : pas de position de lecture partagée entre les threads
+        _append_chunk(dbx, session_id, offset, os.pread(fd, length, offset), close, retry_log)
+        debug(f"Chunk uploadé: offset {offset} ({length} bytes)")
+
+    try:
+        # Le dernier chunk ferme la session : il part une fois tous les autres reçus
+        pending = chunks[:-1]
+        for resume_pass in range(RESUME_PASSES + 1):
+            if resume_pass:
+                print(f"Reprise de la session {session_id}: {len(pending)} chunks à renvoyer")
+                time.sleep(RESUME_DELAY)
+            failed = []
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [(chunk, pool.submit(send, chunk)) for chunk in pending]
+                for chunk, future in futures:
+                    try:
+                        future.result()
+                    except retryable_errors() as e:
+                        failed.append(chunk)
+                        last_error = e
+            pending = failed
+            if not pending:
+                break
+        if pending:
+            raise last_error
+        send(chunks[-1], close=True)
+    finally:
+        os.close(fd)
+
+    cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=file_size)
+    # Tous les chunks sont reçus : une erreur réseau à la validation ne doit pas perdre l'encodage
+    result_upload = _retry_call(
+        "Validation de la session", dbx.files_upload_session_finish, b'', cursor, _commit_info(dropbox_path)
+    )
+    stats = _upload_stats('concurrent', file_size, len(chunks), chunk_size, workers, len(retry_log), started)
+    return result_upload.path_display, stats
+
+
+def _read_full_chunk(stream, size):
+    """Lit exactement size octets sauf en fin de flux (un pipe renvoie des lectures partielles)"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    filled = 0
+    # readinto remplit le tampon préalloué sans concaténations successives
+    while filled < size:
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return bytes(view[:filled])
+
+
+def upload_stream(dbx, stream, dropbox_path, chunk_size=CHUNK_SIZE, ring_size=STREAM_RING_SIZE, before_finish=None):
+    """
+    Upload d'un flux au fil de l'eau : un thread lit le flux par chunks dans une
+    file bornée, le thread courant les envoie dans une session d'upload.
+    before_finish est appelé avant de valider le fichier (ex: vérifier le code retour de ffmpeg).
+    """
+    chunks = Queue(maxsize=ring_size)
+    stop = threading.Event()
+    read_errors = []
+
+    def produce():
+        try:
+            while not stop.is_set():
+                chunk = _read_full_chunk(stream, chunk_size)
+                if not chunk:
+                    break
+                chunks.put(chunk)
+        except Exception as e:
+            read_errors.append(e)
+        finally:
+            chunks.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    started = time.monotonic()
+    total_bytes = 0
+    chunk_count = 0
+    session_id = None
+    retry_log = []
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if session_id is None:
+                session_id = dbx.files_upload_session_start(b'').session_id
+                print(f"Session streaming démarrée: {session_id}")
+            _append_chunk(dbx, session_id, total_bytes, chunk, retry_log=retry_log)
+            chunk_count += 1
+            total_bytes += len(chunk)
+    finally:
+        # Débloque le producteur si l'upload a échoué en cours de route
+        stop.set()
+        while producer.is_alive():
+            while not chunks.empty():
+                chunks.get_nowait()
+            producer.join(timeout=0.1)
+
+    if read_errors:
+        raise read_errors[0]
+    if before_finish:
+        before_finish()
+    if session_id is None:
+        raise RuntimeError("Flux vide, rien à uploader")
+
+    cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=total_bytes)
+    result_upload = _retry_call(
+        "Validation de la session", dbx.files_upload_session_finish, b'', cursor, _commit_info(dropbox_path)
+    )
+    stats = _upload_stats('stream', total_bytes, chunk_count, chunk_size, 1, len(retry_log), started)
+    return result_upload.path_display, stats
+
+
+def encode_and_upload(cmd, dbx, dropbox_path):
+    """
+    Lance ffmpeg avec sortie mp4 fragmentée sur stdout et l'uploade pendant l'encodage.
+    cmd est la commande ffmpeg sans la destination de sortie.
+    """
+    cmd = cmd + FRAGMENTED_MP4_ARGS + ['pipe:1']
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+
+        def check_ffmpeg():
+            if process.wait() != 0:
+                stderr_file.seek(0)
+                raise RuntimeError(f"FFMPEG failed: {stderr_file.read().decode(errors='replace')}")
+
+        try:
+            return upload_stream(dbx, process.stdout, dropbox_path, before_finish=check_ffmpeg)
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+
+
+def create_share_link(dbx, dropbox_path):
+    """Créer lien de partage, avec un texte de repli si la création échoue"""
+    try:
+        shared_link = dbx.sharing_create_shared_link(dropbox_path)
+        print(f"Lien de partage créé: {shared_link.url}")
+        return shared_link.url
+    except Exception as e:
+        print(f"Erreur création lien: {e}")
+        return f"File uploaded to {dropbox_path}"
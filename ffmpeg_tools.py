@@ -0,0 +1,64 @@
+import subprocess
+import json
+import tempfile
+
+
+def run_command(cmd):
+    """Exécute une commande ffmpeg/ffprobe et lève une erreur si elle échoue"""
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{cmd[0]} failed: {result.stderr}")
+    return result.stdout
+
+
+def probe_json(input_path, *entries):
+    """Lance ffprobe avec sortie JSON et retourne le dictionnaire décodé"""
+    cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', *entries, input_path]
+    return json.loads(run_command(cmd))
+
+
+def write_concat_list(paths, list_path):
+    """Écrit un fichier liste pour le demuxer concat de ffmpeg"""
+    with open(list_path, 'w') as f:
+        for path in paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return list_path
+
+
+def write_concat_segments(input_path, segments, list_path):
+    """Liste concat qui relit la même source entre inpoint et outpoint pour chaque segment"""
+    escaped = input_path.replace("'", "'\\''")
+    with open(list_path, 'w') as f:
+        for start, end in segments:
+            f.write(f"file '{escaped}'\ninpoint {start:.6f}\noutpoint {end:.6f}\n")
+    return list_path
+
+
+def concat_demux(paths, list_path, output_path, extra_inputs=(), extra_args=()):
+    """Joint des morceaux sans ré-encodage avec le demuxer concat"""
+    write_concat_list(paths, list_path)
+    cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path]
+    for extra in extra_inputs:
+        cmd += ['-i', extra]
+    cmd += list(extra_args) or ['-c', 'copy']
+    cmd += ['-y', output_path]
+    run_command(cmd)
+    return output_path
+
+
+def iter_command_lines(cmd):
+    """Exécute une commande et renvoie sa sortie ligne par ligne, sans la garder en mémoire"""
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        try:
+            for line in process.stdout:
+                yield line
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            returncode = process.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"{cmd[0]} failed: {stderr.read()}")
@@ -0,0 +1,256 @@
+import os
+import tempfile
+
+from intervals import snap_to_frames
+
+# Segments plus courts que ce seuil sont ignorés par ffmpeg
+MIN_SEGMENT_DURATION = 0.1
+
+# Au-delà de ce nombre de segments, une branche trim par segment devient trop coûteuse
+SELECT_THRESHOLD = 50
+
+# Au-delà de ce nombre de segments, une entrée ffmpeg par segment (démuxeur, décodeur,
+# connexion HTTP chacun) coûte plus cher qu'une seule entrée lue depuis le premier segment
+MAX_SEEK_SEGMENTS = 32
+
+# Taille des trames audio avant aselect : l'audio est coupé à ~5ms près (48kHz) au lieu
+# d'une trame AAC entière (~21ms), pour que la dérive audio/vidéo reste négligeable
+SELECT_AUDIO_FRAME_SAMPLES = 256
+
+# Au-delà de cette taille le graphe passe par -filter_complex_script (limite ARG_MAX)
+FILTER_SCRIPT_THRESHOLD = 32 * 1024
+
+
+def valid_segments(segments, min_duration=MIN_SEGMENT_DURATION):
+    return [seg for seg in segments if seg['end'] - seg['start'] >= min_duration]
+
+
+def choose_strategy(segment_count, strategy='auto'):
+    if strategy in ('trim', 'select'):
+        return strategy
+    return 'select' if segment_count > SELECT_THRESHOLD else 'trim'
+
+
+def _trim_graph(segments, has_video, has_audio, offset):
+    """Une branche trim/atrim par segment puis un nœud concat"""
+    filter_parts = []
+    for i, segment in enumerate(segments):
+        start = segment['start'] - offset
+        duration = segment['end'] - segment['start']
+        if has_video:
+            filter_parts.append(f"[0:v]trim=start={start}:duration={duration},setpts=PTS-STARTPTS[v{i}]")
+        if has_audio:
+            filter_parts.append(f"[0:a]atrim=start={start}:duration={duration},asetpts=PTS-STARTPTS[a{i}]")
+
+    n = len(segments)
+    if n == 1:
+        # Un seul segment valide, pas de concat nécessaire
+        return filter_parts, '[v0]', '[a0]'
+
+    if has_video:
+        filter_parts.append(''.join(f"[v{i}]" for i in range(n)) + f"concat=n={n}:v=1:a=0[outv]")
+    if has_audio:
+        filter_parts.append(''.join(f"[a{i}]" for i in range(n)) + f"concat=n={n}:v=0:a=1[outa]")
+    return filter_parts, '[outv]', '[outa]'
+
+
+def _snap_segments(segments, frame_rate):
+    """
+    Bornes alignées sur la grille des frames (fréquence constante) : chaque segment garde
+    exactement sa durée en frames, sans quoi select arrondit chaque borne indépendamment
+    pour l'audio et la vidéo et la synchronisation dérive au fil des segments.
+    """
+    if not frame_rate:
+        return segments
+    snapped = snap_to_frames([(seg['start'], seg['end']) for seg in segments], frame_rate)
+    return [{"start": start, "end": end} for start, end in snapped]
+
+
+def _select_expression(segments, offset, frame_rate=None):
+    # Intervalles semi-ouverts [start, end[ comme trim ; bornes alignées décalées d'une
+    # demi-frame pour qu'un timestamp arrondi ne fasse pas gagner ou perdre une frame
+    margin = 0.5 / frame_rate if frame_rate else 0
+    terms = [
+        f"gte(t,{round(seg['start'] - offset - margin, 6)})*lt(t,{round(seg['end'] - offset - margin, 6)})"
+        for seg in segments
+    ]
+    return '+'.join(terms)
+
+
+def _audio_select(expression):
+    return f"asetnsamples=n={SELECT_AUDIO_FRAME_SAMPLES}:p=0,aselect='{expression}',asetpts=N/SR/TB"
+
+
+def _video_setpts(segments, offset, frame_rate):
+    """
+    Timestamps vidéo après select : numéro de frame / fréquence si elle est constante,
+    sinon timestamp d'origine moins la durée coupée avant lui (fréquence variable).
+    """
+    if frame_rate:
+        return "setpts=N/FRAME_RATE/TB"
+    terms = []
+    previous_end = offset
+    for seg in segments:
+        terms.append(f"gte(T,{seg['start'] - offset})*{seg['start'] - previous_end}")
+        previous_end = seg['end']
+    return f"setpts='(T-({'+'.join(terms)}))/TB'"
+
+
+def _select_graph(segments, has_video, has_audio, offset, frame_rate):
+    """Un seul select/aselect sur tous les intervalles : un décodage, mémoire constante"""
+    expression = _select_expression(segments, offset, frame_rate)
+    filter_parts = []
+    if has_video:
+        setpts = _video_setpts(segments, offset, frame_rate)
+        filter_parts.append(f"[0:v]select='{expression}',{setpts}[outv]")
+    if has_audio:
+        filter_parts.append(f"[0:a]{_audio_select(expression)}[outa]")
+    return filter_parts, '[outv]', '[outa]'
+
+
+def _graph_args(full_filter, script_dir=None):
+    """Arguments -filter_complex, ou -filter_complex_script dans script_dir (workspace du job) si le graphe est trop long"""
+    if len(full_filter) <= FILTER_SCRIPT_THRESHOLD:
+        return ['-filter_complex', full_filter], None
+    fd, script_path = tempfile.mkstemp(suffix='.filter', dir=script_dir)
+    with os.fdopen(fd, 'w') as f:
+        f.write(full_filter)
+    return ['-filter_complex_script', script_path], script_path
+
+
+def build_filter_graph(segments, has_video, has_audio, strategy='auto', offset=0, frame_rate=None, script_dir=None):
+    """
+    Construit le graphe de filtres pour garder les segments donnés.
+    frame_rate est la fréquence de la source si elle est constante (voir MediaProbe.frame_rate), sinon None.
+    Retourne None si aucun segment n'est assez long, sinon un dict avec les
+    arguments ffmpeg du graphe, les -map de sortie et la stratégie utilisée.
+    Si 'script_path' est renseigné, le fichier temporaire doit être supprimé par l'appelant.
+    """
+    if not has_video and not has_audio:
+        raise ValueError("Aucun stream audio ou vidéo détecté")
+
+    segments = valid_segments(segments)
+    if not segments:
+        return None
+
+    frame_rate = frame_rate if has_video else None
+    strategy = choose_strategy(len(segments), strategy)
+    if strategy == 'select':
+        segments = _snap_segments(segments, frame_rate)
+        if not segments:
+            return None
+        filter_parts, video_label, audio_label = _select_graph(segments, has_video, has_audio, offset, frame_rate)
+    else:
+        filter_parts, video_label, audio_label = _trim_graph(segments, has_video, has_audio, offset)
+
+    maps = []
+    if has_video:
+        maps += ['-map', video_label]
+    if has_audio:
+        maps += ['-map', audio_label]
+
+    args, script_path = _graph_args(';'.join(filter_parts), script_dir)
+
+    return {
+        "args": args,
+        "maps": maps,
+        "strategy": strategy,
+        "segment_count": len(segments),
+        "script_path": script_path,
+    }
+
+
+def build_seek_graph(input_path, segments, has_video, has_audio, frame_rate=None, script_dir=None):
+    """
+    Une entrée ffmpeg par segment avec recherche (-ss/-t) : seules les zones gardées
+    sont lues, ce qui évite de parcourir tout le fichier quand il est lu via HTTP.
+    Au-delà de MAX_SEEK_SEGMENTS, une seule entrée qui démarre au premier segment.
+    """
+    if not has_video and not has_audio:
+        raise ValueError("Aucun stream audio ou vidéo détecté")
+
+    segments = valid_segments(segments)
+    if not segments:
+        return None
+
+    if len(segments) > MAX_SEEK_SEGMENTS:
+        offset = segments[0]['start']
+        graph = build_filter_graph(
+            segments, has_video, has_audio, offset=offset, frame_rate=frame_rate, script_dir=script_dir
+        )
+        graph['inputs'] = ['-ss', str(offset), '-i', input_path]
+        return graph
+
+    inputs = []
+    for segment in segments:
+        inputs += ['-ss', str(segment['start']), '-t', str(segment['end'] - segment['start']), '-i', input_path]
+
+    n = len(segments)
+    streams = ''.join(
+        (f"[{i}:v]" if has_video else '') + (f"[{i}:a]" if has_audio else '')
+        for i in range(n)
+    )
+    outputs = ('[outv]' if has_video else '') + ('[outa]' if has_audio else '')
+    full_filter = f"{streams}concat=n={n}:v={int(has_video)}:a={int(has_audio)}{outputs}"
+
+    maps = []
+    if has_video:
+        maps += ['-map', '[outv]']
+    if has_audio:
+        maps += ['-map', '[outa]']
+
+    return {
+        "inputs": inputs,
+        "args": ['-filter_complex', full_filter],
+        "maps": maps,
+        "strategy": 'seek',
+        "segment_count": n,
+        "script_path": None,
+    }
+
+
+def build_multi_output_graph(variant_segments, has_video, has_audio, frame_rate=None, script_dir=None):
+    """
+    Graphe à plusieurs sorties pour un seul décodage : les flux sont dupliqués avec
+    split/asplit puis chaque branche garde ses intervalles avec select/aselect.
+    variant_segments est une liste de listes de segments (une par sortie).
+    Sur une source à fréquence constante les bornes sont alignées sur les frames, sinon
+    les timestamps sont recalculés par soustraction des durées coupées.
+    Retourne les arguments du graphe et la liste des -map de chaque sortie.
+    """
+    if not has_video and not has_audio:
+        raise ValueError("Aucun stream audio ou vidéo détecté")
+
+    frame_rate = frame_rate if has_video else None
+    variant_segments = [_snap_segments(valid_segments(segments), frame_rate) for segments in variant_segments]
+    if not all(variant_segments):
+        return None
+
+    n = len(variant_segments)
+    filter_parts = []
+    if has_video:
+        filter_parts.append("[0:v]split=" + str(n) + ''.join(f"[vin{i}]" for i in range(n)))
+    if has_audio:
+        filter_parts.append("[0:a]asplit=" + str(n) + ''.join(f"[ain{i}]" for i in range(n)))
+
+    output_maps = []
+    for i, segments in enumerate(variant_segments):
+        expression = _select_expression(segments, 0, frame_rate)
+        maps = []
+        if has_video:
+            setpts = _video_setpts(segments, 0, frame_rate)
+            filter_parts.append(f"[vin{i}]select='{expression}',{setpts}[outv{i}]")
+            maps += ['-map', f"[outv{i}]"]
+        if has_audio:
+            filter_parts.append(f"[ain{i}]{_audio_select(expression)}[outa{i}]")
+            maps += ['-map', f"[outa{i}]"]
+        output_maps.append(maps)
+
+    args, script_path = _graph_args(';'.join(filter_parts), script_dir)
+
+    return {
+        "args": args,
+        "output_maps": output_maps,
+        "strategy": 'split_select',
+        "script_path": script_path,
+    }
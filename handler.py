@@ -1,150 +1,182 @@
-import runpod
-import subprocess
-import requests
-import tempfile
+import asyncio
+import hashlib
 import os
-import dropbox
-import json
-from datetime import datetime
+import shutil
+
+from smart_cut import smart_cut, SmartCutUnsupported
+from parallel_encode import parallel_encode
+from filter_graph import build_filter_graph, build_seek_graph
+from intervals import extract_cut_segments, parse_cuts, invert_cuts_to_keeps, DEFAULT_MIN_GAP
+from logs import debug, debug_enabled
+from downloader import download_file, probe_source, DEFAULT_CONNECTIONS
+from range_proxy import open_partial_source
+from source_cache import SourceCache, get_source_cache
+from probe import load_or_probe, needs_packet_index
+from dropbox_upload import get_client, build_filename, resolve_dropbox_path, upload_file, encode_and_upload, create_share_link
+from batch import handle_batch
+from audio_copy import plan_audio_copy, audio_copy_command, DEFAULT_CUT_TOLERANCE
+from result_store import get_result_store, job_key
+from concurrency import EncodeAdmission, concurrency_modifier, create_workspace, estimate_encode_bytes, run_subprocess
+from metrics import JobMetrics, FFmpegProgress, ProgressReporter, FFMPEG_PROGRESS_ARGS
+from warmup import start_warmup
+
+# Partagé par tous les jobs du worker : limite les encodages simultanés (CPU, disque)
+encode_admission = EncodeAdmission()
 
-def invert_cuts_to_keeps(cuts, total_duration):
-    """Convertit les cuts (à supprimer) en segments à garder"""
-    if not cuts:
-        return [{"start": 0, "end": total_duration}]
-    
-    keeps = []
-    cuts_sorted = sorted(cuts, key=lambda x: x['start'])
-    
-    print(f"=== DEBUG INVERSION ===")
-    print(f"Durée totale: {total_duration}")
-    print(f"Nombre de cuts: {len(cuts_sorted)}")
-    
-    for i, cut in enumerate(cuts_sorted):
-        print(f"Cut {i}: {cut['start']} → {cut['end']}")
-    
-    current_pos = 0
-    
-    for i, cut in enumerate(cuts_sorted):
-        print(f"\nTraitement cut {i}: {cut['start']} → {cut['end']}")
-        print(f"Position actuelle: {current_pos}")
-        
-        # Ajouter segment avant ce cut
-        gap_duration = cut['start'] - current_pos
-        print(f"Gap avant cut: {gap_duration}s")
-        
-        if current_pos < cut['start'] and gap_duration > 0.1:
-            segment = {"start": current_pos, "end": cut['start']}
-            keeps.append(segment)
-            print(f"✓ Segment ajouté: {current_pos} → {cut['start']} (durée: {gap_duration}s)")
-        else:
-            print(f"✗ Gap ignoré (trop court ou négatif)")
-        
-        # Avancer après ce cut
-        current_pos = max(current_pos, cut['end'])
-        print(f"Nouvelle position: {current_pos}")
-    
-    # Segment final
-    final_gap = total_duration - current_pos
-    print(f"\nSegment final potentiel: {current_pos} → {total_duration} (durée: {final_gap}s)")
-    
-    if current_pos < total_duration - 0.1:
-        segment = {"start": current_pos, "end": total_duration}
-        keeps.append(segment)
-        print(f"✓ Segment final ajouté: {current_pos} → {total_duration}")
-    else:
-        print(f"✗ Segment final ignoré")
-    
-    print(f"\nRésultat final: {len(keeps)} segments à garder")
-    for i, keep in enumerate(keeps):
-        duration = keep['end'] - keep['start']
-        print(f"Segment {i}: {keep['start']} → {keep['end']} (durée: {duration}s)")
-    print("===================")
-    
-    return keeps
 
-def handler(event):
+def remember_result(dbx, memo_key, result):
+    """Mémorise le résultat avec l'id du fichier Dropbox, vérifié lors des jobs identiques suivants"""
     try:
+        metadata = dbx.files_get_metadata(result['dropbox_path'])
+        store = get_result_store()
+        # Durées et métriques propres à cette exécution : pas réutilisées
+        store.store(memo_key, {key: value for key, value in result.items() if key not in ('timings', 'metrics')}, metadata.id)
+        store.purge_expired()
+    except Exception as e:
+        print(f"Mémorisation du résultat impossible: {e}")
+
+
+async def handler(event):
+    proxy = None
+    cache_entry = None
+    memo_lock = None
+    workspace = create_workspace(event.get('id'))
+    job_metrics = JobMetrics()
+    try:
+        # Plusieurs listes de cuts sur la même source : un téléchargement, un décodage
+        if 'variants' in event['input']:
+            return await handle_batch(event['input'], encode_admission, workspace)
+        
         print("Début du traitement")
         video_url = event['input']['video_url']
         cuts_data = event['input']['cuts']
         dropbox_folder = event['input'].get('dropbox_folder', '/processed_videos/')
         dropbox_token = event['input']['dropbox_token']
         custom_filename = event['input'].get('filename', None)
+        encode_mode = event['input'].get('encode_mode', 'filter')
+        parallel_workers = event['input'].get('parallel_workers', None)
+        filter_strategy = event['input'].get('filter_strategy', 'auto')
+        stream_upload = event['input'].get('stream_upload', False)
+        fetch_mode = event['input'].get('fetch_mode', 'auto')
+        use_source_cache = event['input'].get('use_source_cache', True)
+        download_connections = int(event['input'].get('download_connections', DEFAULT_CONNECTIONS))
+        min_gap = float(event['input'].get('min_gap', DEFAULT_MIN_GAP))
+        audio_copy = event['input'].get('audio_copy', True)
+        cut_tolerance = float(event['input'].get('cut_tolerance', DEFAULT_CUT_TOLERANCE))
+        memoize = event['input'].get('memoize', True)
         
         print(f"URL vidéo: {video_url}")
-        print(f"Données cuts reçues: {cuts_data}")
-        print(f"Upload vers: {dropbox_folder}")
-        print(f"Nom fichier personnalisé: {custom_filename}")
+        debug(f"Données cuts reçues: {cuts_data}")
+        debug(f"Upload vers: {dropbox_folder}")
+        debug(f"Nom fichier personnalisé: {custom_filename}")
+        print(f"Mode d'encodage: {encode_mode}")
         
-        # Traitement du nouveau format JSON consolidé
-        if isinstance(cuts_data, dict) and 'cuts' in cuts_data:
-            segments = cuts_data['cuts']
-        elif isinstance(cuts_data, list):
-            segments = cuts_data
-        else:
-            # Fallback pour ancien format
-            if isinstance(cuts_data, dict) and 'segments' in cuts_data:
-                segments = cuts_data['segments']
-            else:
-                segments = cuts_data
+        segments = extract_cut_segments(cuts_data)
         
-        print(f"Segments extraits: {len(segments) if isinstance(segments, list) else 'format invalide'}")
+        debug(f"Segments extraits: {len(segments) if isinstance(segments, list) else 'format invalide'}")
         
         # Conversion des segments en format numérique (cuts à supprimer)
-        cuts_to_remove = []
-        for segment in segments:
-            try:
-                start_val = float(segment['start'])
-                end_val = float(segment['end'])
-                
-                print(f"Segment brut: start={start_val}, end={end_val}")
-                
-                # CORRECTION : Tous les timecodes du JSON Claude sont en millisecondes
-                # Conversion systématique ms → secondes
-                start_sec = start_val / 1000
-                end_sec = end_val / 1000
-                print(f"Converti ms→s: {start_val}ms→{start_sec}s, {end_val}ms→{end_sec}s")
-                
-                cuts_to_remove.append({"start": start_sec, "end": end_sec})
-                print(f"Cut à supprimer: {start_sec}s → {end_sec}s (type: {segment.get('type', 'unknown')})")
-            except (ValueError, KeyError) as e:
-                print(f"Erreur conversion segment {segment}: {e}")
-                continue
+        # Tous les timecodes du JSON Claude sont en millisecondes : conversion systématique ms → secondes
+        cuts_to_remove, invalid_count = parse_cuts(segments)
+        if invalid_count:
+            print(f"{invalid_count} segments invalides ignorés")
         
         if not cuts_to_remove:
             return {"error": "Aucun cut valide trouvé"}
         
-        print(f"\n=== RÉSUMÉ CUTS À SUPPRIMER ===")
-        for i, cut in enumerate(cuts_to_remove):
-            duration = cut['end'] - cut['start']
-            print(f"Cut {i}: {cut['start']:.3f}s → {cut['end']:.3f}s (durée: {duration:.3f}s)")
-        print("================================")
-        
-        # Télécharge la vidéo
-        print("Téléchargement de la vidéo...")
-        response = requests.get(video_url, stream=True)
-        response.raise_for_status()
-        
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_video:
-            for chunk in response.iter_content(chunk_size=8192):
-                temp_video.write(chunk)
-            input_path = temp_video.name
-        
-        print(f"Vidéo téléchargée: {input_path}")
+        total_cut = sum(cut['end'] - cut['start'] for cut in cuts_to_remove)
+        print(f"Cuts à supprimer: {len(cuts_to_remove)} ({total_cut:.3f}s au total)")
+        if debug_enabled():
+            for i, cut in enumerate(cuts_to_remove):
+                debug(f"Cut {i}: {cut['start']:.3f}s → {cut['end']:.3f}s (durée: {cut['end'] - cut['start']:.3f}s)")
+        
+        # Une seule sonde HTTP de la source (taille, Range, validateurs), partagée par les étapes suivantes
+        with job_metrics.stage('source_probe'):
+            source_info = await asyncio.to_thread(probe_source, video_url)
+        
+        # Job identique déjà traité (retry amont, webhook en double) : résultat réutilisé
+        memo_key = None
+        if memoize:
+            with job_metrics.stage('memo_lookup'):
+                memo_key = job_key(source_info, video_url, cuts_to_remove, {
+                    # Un autre compte Dropbox ne voit pas le fichier : il ne doit ni le réutiliser ni invalider le résultat
+                    "account": hashlib.sha256(dropbox_token.encode()).hexdigest(),
+                    "dropbox_folder": dropbox_folder.rstrip('/'),
+                    "filename": custom_filename,
+                    "encode_mode": encode_mode,
+                    "filter_strategy": filter_strategy,
+                    "min_gap": min_gap,
+                    "audio_copy": audio_copy,
+                    "cut_tolerance": cut_tolerance,
+                })
+                if memo_key:
+                    # Un doublon simultané attend la fin du premier job puis réutilise son résultat
+                    memo_lock = get_result_store().lock(memo_key)
+                    await asyncio.to_thread(memo_lock.acquire)
+                    memoized = await asyncio.to_thread(
+                        get_result_store().lookup_verified, get_client(dropbox_token), memo_key
+                    )
+            if memo_key and memoized:
+                print(f"Job déjà traité, résultat réutilisé: {memoized['dropbox_path']}")
+                return {**memoized, "memoized": True, "timings": job_metrics.summary(), "metrics": {}}
+        
+        with job_metrics.stage('download'):
+            download_stats = None
+            cache_stats = None
+            # Source déjà en cache (autre liste de cuts sur la même URL) : ni téléchargement ni proxy
+            if use_source_cache:
+                hit = await asyncio.to_thread(get_source_cache().lookup, video_url, source_info)
+                if hit:
+                    cache_entry, cache_stats = hit
+                    download_stats = cache_stats.pop('download')
+            # Sinon lecture partielle via HTTP si seule une petite part de la source est gardée
+            if not cache_entry:
+                proxy = await asyncio.to_thread(
+                    open_partial_source, video_url, cuts_to_remove, fetch_mode, min_gap, source_info,
+                    encode_mode, audio_copy
+                )
         
-        # Obtenir la durée totale du fichier
-        duration_cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'csv=p=0', input_path]
-        duration_result = subprocess.run(duration_cmd, capture_output=True, text=True)
+            if cache_entry:
+                input_path = cache_entry.path
+            elif proxy:
+                input_path = proxy.url
+            elif use_source_cache and SourceCache.cacheable(source_info):
+                # Cache disque du worker : un hit évite téléchargement et sondes ffprobe
+                cache_entry, cache_stats = await asyncio.to_thread(
+                    get_source_cache().acquire, video_url, connections=download_connections, source_info=source_info
+                )
+                input_path = cache_entry.path
+                download_stats = cache_stats.pop('download')
+            else:
+                # Télécharge la vidéo
+                print("Téléchargement de la vidéo...")
+                input_path = os.path.join(workspace, 'source.mp4')
+                download_stats = await asyncio.to_thread(
+                    download_file, video_url, input_path, connections=download_connections, source_info=source_info
+                )
+            
+                print(f"Vidéo téléchargée: {input_path}")
         
-        if duration_result.returncode != 0:
-            print(f"Erreur obtention durée: {duration_result.stderr}")
-            return {"error": f"Impossible d'obtenir la durée: {duration_result.stderr}"}
+        with job_metrics.stage('probe'):
+            # Format et flux, plus l'index des paquets si le smart cut ou la copie audio s'en servent
+            # (jamais via le proxy : l'indexation lirait toute la source distante), réutilisés depuis le cache si possible
+            try:
+                media, probe_reused = await asyncio.to_thread(
+                    load_or_probe,
+                    input_path,
+                    sidecar_path=cache_entry.index_path if cache_entry else None,
+                    with_packets=False if proxy else lambda probed: needs_packet_index(probed, encode_mode, audio_copy)
+                )
+            except RuntimeError as e:
+                print(f"Erreur ffprobe: {e}")
+                return {"error": f"Erreur analyse fichier: {e}"}
         
-        total_duration = float(duration_result.stdout.strip())
+        total_duration = media.duration
         print(f"Durée totale fichier: {total_duration}s")
         
         # Convertir les cuts en segments à garder
-        processed_segments = invert_cuts_to_keeps(cuts_to_remove, total_duration)
+        with job_metrics.stage('intervals'):
+            processed_segments = invert_cuts_to_keeps(cuts_to_remove, total_duration, min_gap=min_gap)
         
         if not processed_segments:
             print("ERREUR: Aucun segment généré après inversion")
@@ -157,280 +189,167 @@ def handler(event):
             
             return {"error": f"Aucun segment à garder après inversion - cuts couvrent {coverage_percent:.1f}% du fichier ({total_cut_duration:.1f}s sur {total_duration:.1f}s)"}
         
-        print("=== SEGMENTS À TRAITER PAR FFMPEG ===")
-        for i, keep in enumerate(processed_segments):
-            duration = keep['end'] - keep['start']
-            print(f"Segment FFMPEG {i}: {keep['start']:.3f}s → {keep['end']:.3f}s (durée: {duration:.3f}s)")
-        print("=====================================")
-        
         # Analyse du fichier pour détecter audio/vidéo
-        probe_cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', input_path]
-        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-        
-        if probe_result.returncode != 0:
-            print(f"Erreur ffprobe: {probe_result.stderr}")
-            return {"error": f"Erreur analyse fichier: {probe_result.stderr}"}
-        
-        probe_data = json.loads(probe_result.stdout)
-        has_video = any(stream['codec_type'] == 'video' for stream in probe_data['streams'])
-        has_audio = any(stream['codec_type'] == 'audio' for stream in probe_data['streams'])
+        has_video = media.has_video
+        has_audio = media.has_audio
         
         print(f"Analyse fichier - Vidéo: {has_video}, Audio: {has_audio}")
         
-        output_path = '/tmp/output.mp4'
+        # Audio seul dans un codec copiable : découpe aux frontières de paquets, sans ré-encodage
+        audio_plan = None
+        if audio_copy and has_audio and not has_video:
+            audio_plan = plan_audio_copy(media, processed_segments, cut_tolerance)
+        extension = audio_plan['extension'] if audio_plan else 'mp4'
+        
+        # Chaque job écrit dans son propre workspace
+        output_path = os.path.join(workspace, f'output.{extension}')
+        graph = None
         
-        if len(processed_segments) == 1:
+        if audio_plan:
+            print(f"Copie audio {audio_plan['codec']} → .{extension} (décalage max {audio_plan['max_shift_ms']}ms)")
+            cmd = audio_copy_command(input_path, audio_plan, os.path.join(workspace, 'segments.txt'), output_path)
+        elif len(processed_segments) == 1:
             # Un seul segment : découpe simple
             segment = processed_segments[0]
             print(f"Découpe simple: {segment['start']} → {segment['end']}")
-            cmd = [
-                'ffmpeg', '-i', input_path,
-                '-ss', str(segment['start']),
-                '-to', str(segment['end']),
-                '-c', 'copy', '-y', output_path
-            ]
-        else:
-            # Plusieurs segments : filtres selon type de média
-            if has_video and has_audio:
-                # Fichier vidéo avec audio
-                filter_parts = []
-                valid_segment_count = 0
-                
-                for i, segment in enumerate(processed_segments):
-                    start = segment['start']
-                    duration = segment['end'] - segment['start']
-                    print(f"Préparation segment {i}: start={start}, duration={duration}")
-                    if duration < 0.1:  # Ignorer segments trop courts
-                        print(f"Segment {i} ignoré (trop court): {duration}s")
-                        continue
-                    filter_parts.append(f"[0:v]trim=start={start}:duration={duration},setpts=PTS-STARTPTS[v{valid_segment_count}]")
-                    filter_parts.append(f"[0:a]atrim=start={start}:duration={duration},asetpts=PTS-STARTPTS[a{valid_segment_count}]")
-                    valid_segment_count += 1
-                
-                if not filter_parts:
-                    return {"error": "Tous les segments sont trop courts après filtrage"}
-                
-                print(f"Segments valides pour FFMPEG: {valid_segment_count}")
-                
-                if valid_segment_count == 1:
-                    # Un seul segment valide, pas de concat nécessaire
-                    full_filter = ';'.join(filter_parts)
-                    cmd = [
-                        'ffmpeg', '-i', input_path,
-                        '-filter_complex', full_filter,
-                        '-map', '[v0]', '-map', '[a0]',
-                        '-c:v', 'libx264', '-c:a', 'aac',
-                        '-y', output_path
-                    ]
-                else:
-                    # Concaténer tous les segments
-                    video_inputs = ''.join([f"[v{i}]" for i in range(valid_segment_count)])
-                    audio_inputs = ''.join([f"[a{i}]" for i in range(valid_segment_count)])
-                    concat_filter = f"{video_inputs}concat=n={valid_segment_count}:v=1:a=0[outv]"
-                    concat_filter += f";{audio_inputs}concat=n={valid_segment_count}:v=0:a=1[outa]"
-                    
-                    full_filter = ';'.join(filter_parts) + ';' + concat_filter
-                    
-                    cmd = [
-                        'ffmpeg', '-i', input_path,
-                        '-filter_complex', full_filter,
-                        '-map', '[outv]', '-map', '[outa]',
-                        '-c:v', 'libx264', '-c:a', 'aac',
-                        '-y', output_path
-                    ]
-                
-            elif has_audio and not has_video:
-                # Fichier audio uniquement
-                filter_parts = []
-                valid_segment_count = 0
-                
-                for i, segment in enumerate(processed_segments):
-                    start = segment['start']
-                    duration = segment['end'] - segment['start']
-                    if duration < 0.1:
-                        continue
-                    filter_parts.append(f"[0:a]atrim=start={start}:duration={duration},asetpts=PTS-STARTPTS[a{valid_segment_count}]")
-                    valid_segment_count += 1
-                
-                if not filter_parts:
-                    return {"error": "Tous les segments audio sont trop courts"}
-                
-                if valid_segment_count == 1:
-                    full_filter = ';'.join(filter_parts)
-                    cmd = [
-                        'ffmpeg', '-i', input_path,
-                        '-filter_complex', full_filter,
-                        '-map', '[a0]',
-                        '-c:a', 'aac', '-y', output_path
-                    ]
-                else:
-                    audio_inputs = ''.join([f"[a{i}]" for i in range(valid_segment_count)])
-                    concat_filter = f"{audio_inputs}concat=n={valid_segment_count}:v=0:a=1[outa]"
-                    
-                    full_filter = ';'.join(filter_parts) + ';' + concat_filter
-                    
-                    cmd = [
-                        'ffmpeg', '-i', input_path,
-                        '-filter_complex', full_filter,
-                        '-map', '[outa]',
-                        '-c:a', 'aac', '-y', output_path
-                    ]
-                
-            elif has_video and not has_audio:
-                # Fichier vidéo sans audio
-                filter_parts = []
-                valid_segment_count = 0
-                
-                for i, segment in enumerate(processed_segments):
-                    start = segment['start']
-                    duration = segment['end'] - segment['start']
-                    if duration < 0.1:
-                        continue
-                    filter_parts.append(f"[0:v]trim=start={start}:duration={duration},setpts=PTS-STARTPTS[v{valid_segment_count}]")
-                    valid_segment_count += 1
-                
-                if not filter_parts:
-                    return {"error": "Tous les segments vidéo sont trop courts"}
-                
-                if valid_segment_count == 1:
-                    full_filter = ';'.join(filter_parts)
-                    cmd = [
-                        'ffmpeg', '-i', input_path,
-                        '-filter_complex', full_filter,
-                        '-map', '[v0]',
-                        '-c:v', 'libx264', '-y', output_path
-                    ]
-                else:
-                    video_inputs = ''.join([f"[v{i}]" for i in range(valid_segment_count)])
-                    concat_filter = f"{video_inputs}concat=n={valid_segment_count}:v=1:a=0[outv]"
-                    
-                    full_filter = ';'.join(filter_parts) + ';' + concat_filter
-                    
-                    cmd = [
-                        'ffmpeg', '-i', input_path,
-                        '-filter_complex', full_filter,
-                        '-map', '[outv]',
-                        '-c:v', 'libx264', '-y', output_path
-                    ]
-            else:
-                return {"error": "Aucun stream audio ou vidéo détecté"}
-        
-        print(f"Commande FFMPEG: {' '.join(cmd)}")
-        
-        # Exécute FFMPEG
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            print(f"Erreur FFMPEG: {result.stderr}")
-            return {"error": f"FFMPEG failed: {result.stderr}"}
-        
-        file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
-        print(f"Traitement terminé, taille: {file_size} bytes")
-        
-        # Upload vers Dropbox avec chunks et sécurité renforcée
-        print(f"Upload vers Dropbox: {dropbox_folder}")
-        
-        dbx = dropbox.Dropbox(dropbox_token)
-        
-        # Génération de nom de fichier sécurisé
-        if custom_filename:
-            import re
-            safe_filename = re.sub(r'[<>:"/\\|?*]', '_', custom_filename)
-            if not safe_filename.lower().endswith('.mp4'):
-                filename = f"{safe_filename}.mp4"
+            if proxy:
+                # Recherche en entrée pour ne lire que la zone gardée
+                cmd = [
+                    'ffmpeg', '-ss', str(segment['start']), '-i', input_path,
+                    '-t', str(segment['end'] - segment['start']),
+                    '-c', 'copy', '-y', output_path
+                ]
             else:
-                filename = safe_filename
+                cmd = [
+                    'ffmpeg', '-i', input_path,
+                    '-ss', str(segment['start']),
+                    '-to', str(segment['end']),
+                    '-c', 'copy', '-y', output_path
+                ]
         else:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"video_cut_{timestamp}.mp4"
-        
-        # Vérification que le fichier n'existe pas déjà
-        dropbox_path = f"{dropbox_folder.rstrip('/')}/{filename}"
-        original_filename = filename
-        counter = 1
-        while True:
-            try:
-                dbx.files_get_metadata(dropbox_path)
-                name_part = original_filename.rsplit('.', 1)[0]
-                extension = original_filename.rsplit('.', 1)[1] if '.' in original_filename else 'mp4'
-                filename = f"{name_part}_{counter}.{extension}"
-                dropbox_path = f"{dropbox_folder.rstrip('/')}/{filename}"
-                counter += 1
-                print(f"Fichier existant détecté, nouveau nom: {filename}")
-            except dropbox.exceptions.ApiError:
-                print(f"Nom de fichier final: {filename}")
-                break
-        
-        # Upload par chunks pour gros fichiers
-        CHUNK_SIZE = 4 * 1024 * 1024  # 4MB par chunk
-        
-        with open(output_path, 'rb') as f:
-            if file_size <= CHUNK_SIZE:
-                print("Upload direct (fichier < 4MB)")
-                contents = f.read()
-                dbx.files_upload(
-                    contents, 
-                    dropbox_path, 
-                    mode=dropbox.files.WriteMode.add,
-                    autorename=True
+            # Plusieurs segments : un seul constructeur de graphe pour tous les types de média
+            if not has_video and not has_audio:
+                return {"error": "Aucun stream audio ou vidéo détecté"}
+            
+            if proxy:
+                # Une entrée par segment : ffmpeg saute directement aux zones gardées
+                graph = build_seek_graph(
+                    input_path, processed_segments, has_video, has_audio,
+                    frame_rate=media.frame_rate, script_dir=workspace
                 )
             else:
-                print(f"Upload par chunks ({file_size} bytes, chunks de {CHUNK_SIZE} bytes)")
-                
-                first_chunk = f.read(CHUNK_SIZE)
-                session_start_result = dbx.files_upload_session_start(first_chunk)
-                cursor = dropbox.files.UploadSessionCursor(
-                    session_id=session_start_result.session_id,
-                    offset=f.tell()
+                graph = build_filter_graph(
+                    processed_segments, has_video, has_audio, strategy=filter_strategy,
+                    frame_rate=media.frame_rate, script_dir=workspace
                 )
-                
-                print(f"Session démarrée: {session_start_result.session_id}")
-                
-                chunk_count = 1
-                while f.tell() < file_size:
-                    chunk_count += 1
-                    remaining = file_size - f.tell()
-                    
-                    if remaining <= CHUNK_SIZE:
-                        print(f"Upload chunk final {chunk_count} ({remaining} bytes)")
-                        final_chunk = f.read(remaining)
-                        commit_info = dropbox.files.CommitInfo(
-                            path=dropbox_path, 
-                            mode=dropbox.files.WriteMode.add,
-                            autorename=True
+            if graph is None:
+                return {"error": "Tous les segments sont trop courts après filtrage"}
+            print(f"Segments valides pour FFMPEG: {graph['segment_count']} (stratégie: {graph['strategy']})")
+            
+            cmd = ['ffmpeg'] + graph.get('inputs', ['-i', input_path]) + graph['args'] + graph['maps']
+            if has_video:
+                cmd += ['-c:v', 'libx264']
+            if has_audio:
+                cmd += ['-c:a', 'aac']
+            cmd += ['-y', output_path]
+        
+        dbx = get_client(dropbox_token)
+        filename = build_filename(custom_filename, extension=extension)
+        streamed = False
+        smart_cut_stats = None
+        parallel_stats = None
+        
+        source_bytes = proxy.size if proxy else os.path.getsize(input_path)
+        total_duration_kept = sum(seg['end'] - seg['start'] for seg in processed_segments)
+        estimated_bytes = estimate_encode_bytes(source_bytes, total_duration_kept, total_duration, encode_mode)
+        
+        # Les encodages passent par le contrôle d'admission, les étapes réseau non
+        async with encode_admission.slot(estimated_bytes) as slot:
+            job_metrics.add('encode_queue', slot.waited)
+            # Smart cut : copie des GOP complets, ré-encodage des bornes uniquement
+            if encode_mode == 'smart' and has_video and len(processed_segments) > 1:
+                work_dir = os.path.join(workspace, 'smartcut')
+                os.makedirs(work_dir)
+                try:
+                    with job_metrics.stage('encode'):
+                        smart_cut_stats = await asyncio.to_thread(
+                            smart_cut, input_path, processed_segments, output_path, work_dir,
+                            has_audio=has_audio, media=media
+                        )
+                except SmartCutUnsupported as e:
+                    print(f"Smart cut impossible, retour au ré-encodage complet: {e}")
+            elif encode_mode == 'parallel' and not audio_plan and len(processed_segments) > 1:
+                # Un processus ffmpeg par lot de segments, joints sans ré-encodage
+                with job_metrics.stage('encode'):
+                    parallel_stats = await asyncio.to_thread(
+                        parallel_encode, input_path, processed_segments, output_path,
+                        has_video=has_video, has_audio=has_audio, workers=parallel_workers,
+                        strategy=filter_strategy, frame_rate=media.frame_rate,
+                        cpu_budget=slot.cpus, work_dir=workspace
+                    )
+            
+            if smart_cut_stats is None and parallel_stats is None:
+                if stream_upload and not audio_plan:
+                    # Upload pendant l'encodage : ffmpeg écrit du mp4 fragmenté sur un pipe
+                    dropbox_path, filename = await asyncio.to_thread(resolve_dropbox_path, dbx, dropbox_folder, filename)
+                    stream_cmd = cmd[:cmd.index('-y')]
+                    debug(f"Commande FFMPEG (streaming): {' '.join(stream_cmd)}")
+                    print(f"Encodage et upload en parallèle vers: {dropbox_path}")
+                    with job_metrics.stage('encode_upload'):
+                        dropbox_path, upload_stats = await asyncio.to_thread(
+                            encode_and_upload, stream_cmd, dbx, dropbox_path
                         )
-                        result_upload = dbx.files_upload_session_finish(final_chunk, cursor, commit_info)
-                        dropbox_path = result_upload.path_display
-                        filename = dropbox_path.split('/')[-1]
-                        break
-                    else:
-                        print(f"Upload chunk {chunk_count} ({CHUNK_SIZE} bytes)")
-                        chunk_data = f.read(CHUNK_SIZE)
-                        dbx.files_upload_session_append_v2(chunk_data, cursor)
-                        cursor.offset = f.tell()
+                    file_size = upload_stats['bytes']
+                    filename = dropbox_path.split('/')[-1]
+                    streamed = True
+                else:
+                    # Progression lue sur stdout (-progress) et relayée à RunPod pendant l'encodage
+                    progress = FFmpegProgress(total_duration_kept, ProgressReporter(event))
+                    cmd = cmd[:1] + FFMPEG_PROGRESS_ARGS + cmd[1:]
+                    debug(f"Commande FFMPEG: {' '.join(cmd)}")
+                    
+                    # Exécute FFMPEG sans bloquer les autres jobs du worker
+                    try:
+                        with job_metrics.stage('encode'):
+                            await run_subprocess(cmd, on_stdout_line=progress.feed)
+                    except RuntimeError as e:
+                        print(f"Erreur FFMPEG: {e}")
+                        return {"error": f"FFMPEG failed: {e}"}
+                    job_metrics.set('ffmpeg', progress.state)
+        
+        if not streamed:
+            file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+            print(f"Traitement terminé, taille: {file_size} bytes")
+            
+            # Upload vers Dropbox avec chunks et sécurité renforcée
+            print(f"Upload vers Dropbox: {dropbox_folder}")
+            with job_metrics.stage('upload'):
+                dropbox_path, filename = await asyncio.to_thread(resolve_dropbox_path, dbx, dropbox_folder, filename)
+                dropbox_path, upload_stats = await asyncio.to_thread(upload_file, dbx, output_path, dropbox_path)
+            filename = dropbox_path.split('/')[-1]
         
         print(f"Fichier uploadé avec succès: {dropbox_path}")
         
         # Créer lien de partage
-        try:
-            shared_link = dbx.sharing_create_shared_link(dropbox_path)
-            download_url = shared_link.url
-            print(f"Lien de partage créé: {download_url}")
-        except Exception as e:
-            print(f"Erreur création lien: {e}")
-            download_url = f"File uploaded to {dropbox_path}"
-        
-        # Nettoyage des fichiers temporaires
-        try:
-            os.unlink(input_path)
-            os.unlink(output_path)
-        except:
-            pass
-        
-        # Calcul de la durée totale conservée
-        total_duration_kept = sum(seg['end'] - seg['start'] for seg in processed_segments)
-        
-        return {
+        with job_metrics.stage('share_link'):
+            download_url = await asyncio.to_thread(create_share_link, dbx, dropbox_path)
+        
+        fetch_stats = None
+        if proxy:
+            fetch_stats = proxy.stats()
+            print(f"Octets lus depuis la source: {fetch_stats['bytes_transferred']} sur {fetch_stats['source_size']}")
+        elif cache_stats and cache_stats['hit']:
+            fetch_stats = {"mode": "cache", "bytes_transferred": 0}
+        
+        # Vitesse d'encodage rapportée à la durée gardée (1.0 = temps réel)
+        encode_seconds = job_metrics.timings.get('encode') or job_metrics.timings.get('encode_upload')
+        if encode_seconds:
+            job_metrics.set('encode_realtime_factor', round(total_duration_kept / encode_seconds, 2))
+        if download_stats:
+            job_metrics.set('download_throughput_mbps', download_stats['throughput_mbps'])
+        job_metrics.set('upload_throughput_mbps', upload_stats['throughput_mbps'])
+        
+        result = {
             "success": True,
             "message": "Video processed and uploaded to Dropbox safely",
             "dropbox_path": dropbox_path,
@@ -439,15 +358,49 @@ def handler(event):
             "output_size_mb": round(file_size / 1024 / 1024, 2),
             "segments_processed": len(processed_segments),
             "total_duration_kept": round(total_duration_kept, 2),
-            "chunks_uploaded": chunk_count if file_size > CHUNK_SIZE else 1,
+            "chunks_uploaded": upload_stats['chunks'],
+            "upload": upload_stats,
+            "streamed_upload": streamed,
+            "download": download_stats,
+            "fetch": fetch_stats or {"mode": "full", "bytes_transferred": download_stats['bytes'] if download_stats else 0},
+            "source_cache": cache_stats,
+            "probe_reused": probe_reused,
             "media_type": f"video: {has_video}, audio: {has_audio}",
             "cuts_removed": len(cuts_to_remove),
-            "security_mode": "safe_upload_no_overwrite"
+            "security_mode": "safe_upload_no_overwrite",
+            "encode_mode": "smart" if smart_cut_stats else "parallel" if parallel_stats else "copy" if audio_plan else "filter",
+            "audio_copy": {key: audio_plan[key] for key in ('codec', 'extension', 'max_shift_ms')} if audio_plan else None,
+            "smart_cut": smart_cut_stats,
+            "parallel": parallel_stats,
+            "filter_strategy": graph['strategy'] if graph and not (smart_cut_stats or parallel_stats) else None,
+            "timings": job_metrics.summary(),
+            "metrics": job_metrics.metrics,
+            "memoized": False
         }
         
+        if memo_key:
+            await asyncio.to_thread(remember_result, dbx, memo_key, result)
+        return result
+        
     except Exception as e:
         print(f"Erreur: {str(e)}")
         return {"error": str(e)}
+    
+    finally:
+        # Nettoyage des fichiers temporaires
+        if proxy:
+            proxy.stop()
+        if cache_entry:
+            cache_entry.release()
+        if memo_lock:
+            memo_lock.release()
+        shutil.rmtree(workspace, ignore_errors=True)
 
 if __name__ == "__main__":
-    runpod.serverless.start({"handler": handler})
+    # ffmpeg, SDK Dropbox et connexion à l'API préparés pendant le chargement de RunPod
+    start_warmup()
+    import runpod
+    runpod.serverless.start({
+        "handler": handler,
+        "concurrency_modifier": concurrency_modifier
+    })
@@ -0,0 +1,117 @@
+import bisect
+
+from logs import debug, debug_enabled
+
+# Un segment à garder plus court que cet écart est ignoré
+DEFAULT_MIN_GAP = 0.1
+
+
+def extract_cut_segments(cuts_data):
+    """Extrait la liste des segments des différents formats JSON acceptés"""
+    # Traitement du nouveau format JSON consolidé
+    if isinstance(cuts_data, dict) and 'cuts' in cuts_data:
+        return cuts_data['cuts']
+    if isinstance(cuts_data, list):
+        return cuts_data
+    # Fallback pour ancien format
+    if isinstance(cuts_data, dict) and 'segments' in cuts_data:
+        return cuts_data['segments']
+    return cuts_data
+
+
+def parse_cuts(segments, scale=0.001):
+    """
+    Convertit les segments bruts du JSON (millisecondes) en cuts numériques en secondes.
+    Retourne la liste des cuts et le nombre de segments invalides ignorés.
+    """
+    cuts = []
+    invalid = 0
+    for segment in segments:
+        try:
+            cuts.append((float(segment['start']) * scale, float(segment['end']) * scale))
+        except (ValueError, KeyError, TypeError) as e:
+            invalid += 1
+            debug(f"Erreur conversion segment {segment}: {e}")
+    return [{"start": start, "end": end} for start, end in cuts], invalid
+
+
+def normalize_cuts(cuts, total_duration=None):
+    """
+    Trie et fusionne les cuts qui se chevauchent en une seule passe,
+    en les bornant à [0, total_duration]. Retourne une liste de tuples (start, end).
+    """
+    pairs = sorted((cut['start'], cut['end']) for cut in cuts)
+    merged = []
+    for start, end in pairs:
+        if start < 0:
+            start = 0.0
+        if total_duration is not None and end > total_duration:
+            end = total_duration
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def snap_to_frames(intervals, frame_rate):
+    """Aligne les bornes sur la grille des frames, sans chevaucher l'intervalle précédent"""
+    snapped = []
+    previous_end = 0.0
+    for start, end in intervals:
+        start = max(round(start * frame_rate) / frame_rate, previous_end)
+        end = round(end * frame_rate) / frame_rate
+        if end > start:
+            snapped.append((start, end))
+            previous_end = end
+    return snapped
+
+
+def snap_to_keyframes(intervals, keyframes, tolerance=0.5):
+    """
+    Avance le début de chaque intervalle jusqu'à la première keyframe à moins de tolerance.
+    Jamais en arrière : le début reculerait dans la zone coupée, voire sur l'intervalle précédent.
+    """
+    if not keyframes:
+        return list(intervals)
+    snapped = []
+    for start, end in intervals:
+        idx = bisect.bisect_left(keyframes, start)
+        if idx < len(keyframes) and keyframes[idx] - start <= tolerance and keyframes[idx] < end:
+            start = keyframes[idx]
+        snapped.append((start, end))
+    return snapped
+
+
+def invert_cuts_to_keeps(cuts, total_duration, min_gap=DEFAULT_MIN_GAP, frame_rate=None, keyframes=None):
+    """Convertit les cuts (à supprimer) en segments à garder"""
+    if not cuts:
+        return [{"start": 0, "end": total_duration}]
+
+    merged = normalize_cuts(cuts, total_duration)
+
+    keeps = []
+    current_pos = 0.0
+    for start, end in merged:
+        if start - current_pos > min_gap:
+            keeps.append((current_pos, start))
+        current_pos = max(current_pos, end)
+
+    if current_pos < total_duration - min_gap:
+        keeps.append((current_pos, total_duration))
+
+    if frame_rate:
+        keeps = snap_to_frames(keeps, frame_rate)
+    if keyframes:
+        keeps = snap_to_keyframes(keeps, keyframes)
+
+    kept = sum(end - start for start, end in keeps)
+    print(f"Inversion: {len(cuts)} cuts ({len(merged)} après fusion) → {len(keeps)} segments à garder, {kept:.3f}s sur {total_duration:.3f}s")
+    if debug_enabled():
+        for i, (start, end) in enumerate(keeps):
+            debug(f"Segment {i}: {start:.3f}s → {end:.3f}s (durée: {end - start:.3f}s)")
+
+    return [{"start": start, "end": end} for start, end in keeps]
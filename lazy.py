@@ -0,0 +1,24 @@
+import importlib
+
+
+class LazyModule:
+    """Module importé au premier accès à l'un de ses attributs, pas au chargement du handler"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            # importlib est protégé par les verrous d'import : sûr depuis plusieurs threads
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+def lazy_import(name):
+    return LazyModule(name)
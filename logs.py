@@ -0,0 +1,16 @@
+import os
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+# Niveau de log global, réglable par la variable d'environnement LOG_LEVEL
+LOG_LEVEL = LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), LEVELS['INFO'])
+
+
+def debug_enabled():
+    return LOG_LEVEL <= LEVELS['DEBUG']
+
+
+def debug(message):
+    """Logs détaillés (par segment, par cut) affichés uniquement en LOG_LEVEL=DEBUG"""
+    if LOG_LEVEL <= LEVELS['DEBUG']:
+        print(message)
@@ -0,0 +1,129 @@
+import contextlib
+import os
+import time
+
+from lazy import lazy_import
+from logs import debug
+
+runpod = lazy_import('runpod')
+
+# Intervalle minimal entre deux mises à jour de progression envoyées à RunPod
+PROGRESS_INTERVAL = 5.0
+
+# Options ffmpeg : progression machine-lisible sur stdout, sans la ligne de stats sur stderr
+FFMPEG_PROGRESS_ARGS = ['-progress', 'pipe:1', '-nostats']
+
+
+class JobMetrics:
+    """Durées par étape (horloge monotone) et métriques d'un job, renvoyées dans le résultat"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.timings = {}
+        self.metrics = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            # Une étape répétée (ex: encodage repris après un smart cut impossible) cumule ses durées
+            self.add(name, elapsed)
+            debug(f"Étape {name}: {elapsed:.3f}s")
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def set(self, key, value):
+        self.metrics[key] = value
+
+    def timings_dict(self):
+        timings = {name: round(seconds, 3) for name, seconds in self.timings.items()}
+        timings['total'] = round(time.monotonic() - self.started, 3)
+        return timings
+
+    def summary(self):
+        timings = self.timings_dict()
+        print("Durées: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+        return timings
+
+
+def _parse_time(value):
+    """Convertit 'HH:MM:SS.micro' en secondes (None si la valeur est 'N/A')"""
+    try:
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+
+class FFmpegProgress:
+    """
+    Lit la sortie de 'ffmpeg -progress' (lignes clé=valeur, un bloc terminé par
+    progress=continue|end) et en tire frames, fps, vitesse et position d'encodage.
+    """
+
+    def __init__(self, expected_duration=None, on_update=None):
+        self.expected_duration = expected_duration
+        self.on_update = on_update
+        self.block = {}
+        self.state = {}
+        self.updates = 0
+
+    def feed(self, line):
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return
+        self.block[key] = value.strip()
+        if key == 'progress':
+            self._update(self.block)
+            self.block = {}
+
+    def _update(self, block):
+        state = {}
+        try:
+            state['frames'] = int(block['frame'])
+        except (KeyError, ValueError):
+            pass
+        try:
+            state['fps'] = float(block['fps'])
+        except (KeyError, ValueError):
+            pass
+        speed = block.get('speed', '').rstrip('x')
+        try:
+            state['speed'] = float(speed)
+        except ValueError:
+            pass
+        out_time = _parse_time(block.get('out_time', ''))
+        if out_time is not None:
+            state['out_time'] = round(out_time, 3)
+            if self.expected_duration:
+                state['percent'] = round(min(out_time / self.expected_duration, 1) * 100, 1)
+        state['done'] = block.get('progress') == 'end'
+        if state['done'] and self.expected_duration:
+            state['percent'] = 100.0
+        self.state.update(state)
+        self.updates += 1
+        if self.on_update:
+            self.on_update(dict(self.state))
+
+
+class ProgressReporter:
+    """Relaie la progression d'encodage vers RunPod, au plus une fois par PROGRESS_INTERVAL"""
+
+    def __init__(self, event, interval=PROGRESS_INTERVAL):
+        self.event = event
+        self.interval = interval
+        self.last_sent = 0
+
+    def __call__(self, state):
+        now = time.monotonic()
+        if not state.get('done') and now - self.last_sent < self.interval:
+            return
+        self.last_sent = now
+        debug(f"Progression encodage: {state}")
+        # Hors d'un worker RunPod (exécution locale, --test_input, benchmarks) il n'y a rien à notifier
+        if self.event.get('id') and os.environ.get('RUNPOD_WEBHOOK_POST_OUTPUT'):
+            runpod.serverless.progress_update(self.event, {"stage": "encode", **state})
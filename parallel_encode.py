@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg_tools import run_command, concat_demux
+from filter_graph import build_filter_graph
+
+# Mêmes réglages d'encodage pour tous les morceaux, sinon la concaténation sans ré-encodage échoue
+VIDEO_ENCODER_ARGS = ['-c:v', 'libx264']
+AUDIO_ENCODER_ARGS = ['-c:a', 'aac']
+
+
+def default_worker_count():
+    return max(1, os.cpu_count() or 1)
+
+
+def pack_segments(segments, batch_count):
+    """
+    Regroupe des segments consécutifs en lots de durées équilibrées.
+    L'ordre est conservé pour que la concaténation finale reste correcte.
+    """
+    batch_count = max(1, min(batch_count, len(segments)))
+    total = sum(seg['end'] - seg['start'] for seg in segments)
+    target = total / batch_count
+
+    batches = []
+    current = []
+    current_duration = 0.0
+    for i, segment in enumerate(segments):
+        current.append(segment)
+        current_duration += segment['end'] - segment['start']
+        remaining_segments = len(segments) - i - 1
+        remaining_batches = batch_count - len(batches) - 1
+        # Fermer le lot quand il atteint la cible, en gardant au moins un segment par lot restant
+        if remaining_batches > 0 and (current_duration >= target or remaining_segments == remaining_batches):
+            batches.append(current)
+            current = []
+            current_duration = 0.0
+    if current:
+        batches.append(current)
+    return batches
+
+
+def encode_batch(input_path, batch, output_path, has_video, has_audio, threads, strategy='auto', frame_rate=None, script_dir=None):
+    """Encode un lot de segments dans un processus ffmpeg dédié"""
+    # Recherche rapide au début du lot pour ne pas décoder tout le fichier
+    offset = batch[0]['start']
+    graph = build_filter_graph(batch, has_video, has_audio, strategy=strategy, offset=offset, frame_rate=frame_rate, script_dir=script_dir)
+    if graph is None:
+        return None
+    cmd = ['ffmpeg', '-ss', str(offset), '-i', input_path] + graph['args']
+    cmd += ['-filter_complex_threads', str(threads)]
+    cmd += graph['maps']
+    if has_video:
+        cmd += VIDEO_ENCODER_ARGS
+    if has_audio:
+        cmd += AUDIO_ENCODER_ARGS
+    cmd += ['-threads', str(threads), '-y', output_path]
+    try:
+        run_command(cmd)
+    finally:
+        if graph['script_path']:
+            os.unlink(graph['script_path'])
+    return output_path
+
+
+def parallel_encode(input_path, segments, output_path, has_video=True, has_audio=True, workers=None, batches_per_worker=1, strategy='auto', frame_rate=None, cpu_budget=None, work_dir=None):
+    """
+    Encode les segments en parallèle (un processus ffmpeg par lot) puis
+    joint les morceaux sans ré-encodage avec le demuxer concat.
+    cpu_budget (cœurs accordés par le contrôle d'admission) borne workers x threads.
+    Les morceaux intermédiaires sont écrits sous work_dir (workspace du job).
+    """
+    cpu_budget = cpu_budget or default_worker_count()
+    workers = min(workers or cpu_budget, cpu_budget)
+    batches = pack_segments(segments, workers * batches_per_worker)
+    workers = min(workers, len(batches))
+    # Budget de threads par processus pour ne pas surcharger les cœurs
+    threads = max(1, cpu_budget // workers)
+    print(f"Encodage parallèle: {len(segments)} segments en {len(batches)} lots, {workers} workers x {threads} threads")
+
+    parts_dir = tempfile.mkdtemp(prefix='parallel_', dir=work_dir)
+    try:
+        part_paths = [os.path.join(parts_dir, f"part_{i:05d}.mp4") for i in range(len(batches))]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(encode_batch, input_path, batch, path, has_video, has_audio, threads, strategy, frame_rate, parts_dir)
+                for batch, path in zip(batches, part_paths)
+            ]
+            # Les lots dont tous les segments sont trop courts ne produisent pas de morceau
+            part_paths = [future.result() for future in futures]
+        part_paths = [path for path in part_paths if path]
+        if not part_paths:
+            raise RuntimeError("Tous les segments sont trop courts après filtrage")
+
+        if len(part_paths) == 1:
+            shutil.move(part_paths[0], output_path)
+        else:
+            concat_demux(part_paths, os.path.join(parts_dir, 'parts.txt'), output_path)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    return {
+        "batches": len(batches),
+        "workers": workers,
+        "threads_per_worker": threads,
+    }
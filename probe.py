@@ -0,0 +1,211 @@
+import array
+import bisect
+import fractions
+import json
+import os
+import sys
+import tempfile
+
+from audio_copy import AUDIO_COPY_CONTAINERS
+from ffmpeg_tools import probe_json, iter_command_lines
+
+SIDECAR_MAGIC = b'VCPIDX1\n'
+
+
+def is_video_stream(stream):
+    """Flux vidéo réel : les pochettes (attached_pic) des MP3/M4A ne comptent pas"""
+    return stream['codec_type'] == 'video' and not stream.get('disposition', {}).get('attached_pic')
+
+
+def is_constant_frame_rate(stream):
+    """Fréquence constante : fréquence de base (r_frame_rate) égale à la fréquence moyenne (avg_frame_rate)"""
+    try:
+        return fractions.Fraction(stream['r_frame_rate']) == fractions.Fraction(stream['avg_frame_rate'])
+    except (KeyError, ValueError, ZeroDivisionError):
+        # 0/0 ou fréquence absente : rien ne garantit un pas constant
+        return False
+
+
+class MediaProbe:
+    """
+    Résultat d'une sonde ffprobe : format, flux et, si demandé, index compact des paquets
+    (timestamps des paquets et des keyframes du flux principal, stockés en array('d')).
+    """
+
+    def __init__(self, format_info, streams, index_stream=None, packet_pts=None, keyframes=None):
+        self.format = format_info
+        self.streams = streams
+        self.index_stream = index_stream
+        self.packet_pts = packet_pts if packet_pts is not None else array.array('d')
+        self.keyframes = keyframes if keyframes is not None else array.array('d')
+
+    @property
+    def duration(self):
+        return float(self.format['duration'])
+
+    @property
+    def has_video(self):
+        return any(is_video_stream(stream) for stream in self.streams)
+
+    @property
+    def has_audio(self):
+        return any(stream['codec_type'] == 'audio' for stream in self.streams)
+
+    @property
+    def frame_rate(self):
+        """Fréquence du flux vidéo si elle est constante, sinon None (fréquence variable ou pas de vidéo)"""
+        stream = self.first_stream('video')
+        if stream is None or not is_constant_frame_rate(stream):
+            return None
+        return float(fractions.Fraction(stream['r_frame_rate']))
+
+    @property
+    def has_index(self):
+        return len(self.packet_pts) > 0
+
+    def first_stream(self, codec_type):
+        if codec_type == 'video':
+            return next((stream for stream in self.streams if is_video_stream(stream)), None)
+        return next((stream for stream in self.streams if stream['codec_type'] == codec_type), None)
+
+    def keyframe_before(self, t):
+        """Dernière keyframe <= t (None s'il n'y en a pas), en O(log n)"""
+        idx = bisect.bisect_right(self.keyframes, t) - 1
+        return self.keyframes[idx] if idx >= 0 else None
+
+    def keyframe_after(self, t):
+        """Première keyframe >= t (None s'il n'y en a pas), en O(log n)"""
+        idx = bisect.bisect_left(self.keyframes, t)
+        return self.keyframes[idx] if idx < len(self.keyframes) else None
+
+    def packet_before(self, t):
+        """Début du dernier paquet <= t sur le flux indexé"""
+        idx = bisect.bisect_right(self.packet_pts, t) - 1
+        return self.packet_pts[idx] if idx >= 0 else None
+
+    def packet_after(self, t):
+        """Début du premier paquet >= t sur le flux indexé"""
+        idx = bisect.bisect_left(self.packet_pts, t)
+        return self.packet_pts[idx] if idx < len(self.packet_pts) else None
+
+    def save(self, path):
+        """Écrit le sidecar : en-tête JSON puis les tableaux bruts (écriture atomique)"""
+        header = json.dumps({
+            "format": self.format,
+            "streams": self.streams,
+            "index_stream": self.index_stream,
+            "packet_count": len(self.packet_pts),
+            "keyframe_count": len(self.keyframes),
+            "byteorder": sys.byteorder,
+        }).encode()
+        # Fichier temporaire unique : plusieurs jobs (threads) peuvent sonder la même source en même temps
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp'
+        )
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SIDECAR_MAGIC)
+            f.write(len(header).to_bytes(4, 'little'))
+            f.write(header)
+            f.write(self.packet_pts.tobytes())
+            f.write(self.keyframes.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(SIDECAR_MAGIC)) != SIDECAR_MAGIC:
+                raise ValueError(f"Sidecar invalide: {path}")
+            header = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+            packet_pts = array.array('d')
+            packet_pts.frombytes(f.read(header['packet_count'] * packet_pts.itemsize))
+            keyframes = array.array('d')
+            keyframes.frombytes(f.read(header['keyframe_count'] * keyframes.itemsize))
+        if header['byteorder'] != sys.byteorder:
+            packet_pts.byteswap()
+            keyframes.byteswap()
+        return cls(header['format'], header['streams'], header['index_stream'], packet_pts, keyframes)
+
+
+def probe_media(input_path, with_packets=False):
+    """
+    Sonde le format et les flux, puis (si with_packets) indexe les paquets du flux principal.
+    with_packets peut être une fonction qui décide à partir de la sonde des flux.
+    """
+    data = probe_json(input_path, '-show_format', '-show_streams')
+    probe = MediaProbe(data.get('format', {}), data.get('streams', []))
+    if _wants_index(with_packets, probe):
+        index_packets(probe, input_path)
+    return probe
+
+
+def _wants_index(with_packets, probe):
+    return with_packets(probe) if callable(with_packets) else bool(with_packets)
+
+
+def index_packets(probe, input_path):
+    """
+    Index des paquets du flux principal (la première vidéo, sinon le premier audio).
+    Lit tout le fichier sans décoder : à éviter sur une source distante.
+    La sortie csv est lue ligne par ligne directement dans les array('d').
+    """
+    main_stream = probe.first_stream('video') or probe.first_stream('audio')
+    if main_stream is None:
+        return probe
+
+    packet_pts = array.array('d')
+    keyframes = array.array('d')
+    cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', str(main_stream['index']),
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', input_path
+    ]
+    for line in iter_command_lines(cmd):
+        pts, _, flags = line.rstrip().partition(',')
+        try:
+            pts = float(pts)
+        except ValueError:
+            continue
+        packet_pts.append(pts)
+        if 'K' in flags:
+            keyframes.append(pts)
+
+    # L'ordre de sortie suit l'ordre de décodage (B-frames) : tri pour la recherche dichotomique
+    probe.index_stream = main_stream['index']
+    probe.packet_pts = _sorted_array(packet_pts)
+    probe.keyframes = _sorted_array(keyframes)
+    return probe
+
+
+def _sorted_array(values):
+    if all(values[i] <= values[i + 1] for i in range(len(values) - 1)):
+        return values
+    return array.array('d', sorted(values))
+
+
+def needs_packet_index(media, encode_mode, audio_copy):
+    """L'index des paquets ne sert qu'au smart cut (keyframes vidéo) et à la copie audio (frontières de paquets)"""
+    if media.has_video:
+        return encode_mode == 'smart'
+    stream = media.first_stream('audio')
+    return bool(audio_copy) and stream is not None and stream.get('codec_name') in AUDIO_COPY_CONTAINERS
+
+
+def load_or_probe(input_path, sidecar_path=None, with_packets=False):
+    """Réutilise le sidecar d'un job précédent sur la même source, sinon sonde et l'écrit"""
+    if sidecar_path and os.path.exists(sidecar_path):
+        try:
+            probe = MediaProbe.load(sidecar_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Sidecar illisible, nouvelle sonde: {e}")
+        else:
+            if probe.has_index or not _wants_index(with_packets, probe):
+                print(f"Sonde réutilisée depuis le sidecar ({len(probe.packet_pts)} paquets indexés)")
+                return probe, True
+            # Sidecar sans index (job précédent sans smart cut) : seuls les paquets manquent
+            index_packets(probe, input_path)
+            probe.save(sidecar_path)
+            return probe, True
+
+    probe = probe_media(input_path, with_packets=with_packets)
+    if sidecar_path:
+        probe.save(sidecar_path)
+    return probe, False
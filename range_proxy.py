@@ -0,0 +1,215 @@
+import os
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from downloader import REQUEST_TIMEOUT, probe_source
+from filter_graph import MAX_SEEK_SEGMENTS, valid_segments
+from intervals import invert_cuts_to_keeps, DEFAULT_MIN_GAP
+from probe import probe_media, needs_packet_index
+from lazy import lazy_import
+
+requests = lazy_import('requests')
+
+# Taille des blocs récupérés et mis en cache depuis la source
+BLOCK_SIZE = 1024 * 1024
+
+# Nombre de blocs demandés d'un coup quand ffmpeg lit séquentiellement
+READAHEAD_BLOCKS = 4
+
+# Lecture partielle si la part gardée de la source est inférieure à ce ratio
+PARTIAL_FETCH_MAX_RATIO = 0.5
+
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class RangeCachingProxy:
+    """
+    Proxy HTTP local devant une source distante : ffprobe/ffmpeg lisent l'URL du proxy
+    et peuvent s'y déplacer librement, seuls les blocs réellement lus sont téléchargés
+    (une seule fois, ils sont gardés dans un fichier cache creux).
+    """
+
+    def __init__(self, source_url, size, block_size=BLOCK_SIZE):
+        self.source_url = source_url
+        self.size = size
+        self.block_size = block_size
+        self.block_count = -(-size // block_size)
+        self.fetched = set()
+        self.bytes_transferred = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        cache_fd, self.cache_path = tempfile.mkstemp(suffix='.partial')
+        os.close(cache_fd)
+        self.cache_fd = os.open(self.cache_path, os.O_RDWR)
+        os.ftruncate(self.cache_fd, size)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/source"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
+        os.close(self.cache_fd)
+        try:
+            os.unlink(self.cache_path)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {
+            "mode": "partial",
+            "source_size": self.size,
+            "bytes_transferred": self.bytes_transferred,
+            "upstream_requests": self.requests,
+            "fraction_transferred": round(self.bytes_transferred / self.size, 4) if self.size else None,
+        }
+
+    def ensure_blocks(self, first, last):
+        """Télécharge les blocs manquants de [first, last] en une requête par suite contiguë"""
+        with self.lock:
+            missing = [i for i in range(first, last + 1) if i not in self.fetched]
+            if not missing:
+                return
+            run_start = missing[0]
+            previous = missing[0]
+            for index in missing[1:] + [None]:
+                if index is not None and index == previous + 1:
+                    previous = index
+                    continue
+                self._fetch_run(run_start, previous)
+                if index is not None:
+                    run_start = previous = index
+
+    def _fetch_run(self, first, last):
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size) - 1
+        response = self.session.get(
+            self.source_url, headers={'Range': f"bytes={start}-{end}"}, timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise RuntimeError(f"La source ne respecte pas les Range (HTTP {response.status_code})")
+        os.pwrite(self.cache_fd, response.content, start)
+        self.bytes_transferred += len(response.content)
+        self.requests += 1
+        self.fetched.update(range(first, last + 1))
+
+    def _make_handler(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(proxy.size))
+                self.end_headers()
+
+            def do_GET(self):
+                start, end = 0, proxy.size - 1
+                match = RANGE_PATTERN.fullmatch(self.headers.get('Range', '').strip())
+                if match and not match.group(1) and not match.group(2):
+                    # 'bytes=-' n'est pas une plage valide : en-tête ignoré, réponse complète
+                    match = None
+                if match and match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)) if match.group(2) else proxy.size - 1, proxy.size - 1)
+                elif match:
+                    # Plage suffixe 'bytes=-N' : les N derniers octets (fin du fichier, ex: moov en queue de MP4)
+                    suffix_length = int(match.group(2))
+                    start = max(proxy.size - suffix_length, 0) if suffix_length else proxy.size
+                if start >= proxy.size or start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{proxy.size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self.send_response(206 if match else 200)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Range', f'bytes {start}-{end}/{proxy.size}')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+
+                position = start
+                last_block = end // proxy.block_size
+                try:
+                    while position <= end:
+                        block = position // proxy.block_size
+                        proxy.ensure_blocks(block, min(block + READAHEAD_BLOCKS - 1, last_block))
+                        block_end = min((block + 1) * proxy.block_size, end + 1)
+                        self.wfile.write(os.pread(proxy.cache_fd, block_end - position, position))
+                        position = block_end
+                except (BrokenPipeError, ConnectionResetError):
+                    # ffmpeg ferme la connexion quand il se déplace dans le fichier
+                    self.close_connection = True
+
+        return Handler
+
+
+def open_partial_source(video_url, cuts, fetch_mode='auto', min_gap=DEFAULT_MIN_GAP, source_info=None,
+                        encode_mode='filter', audio_copy=True):
+    """
+    Décide entre téléchargement complet et lecture partielle. Retourne le proxy démarré
+    si la lecture partielle est retenue, sinon None (téléchargement complet).
+    Le smart cut et la copie audio indexent les paquets de toute la source : téléchargement complet.
+    """
+    if fetch_mode == 'full':
+        return None
+
+    info = source_info or probe_source(video_url)
+    if not info["accept_ranges"] or not info["size"]:
+        print("Source sans support des Range, téléchargement complet")
+        return None
+
+    proxy = RangeCachingProxy(video_url, info["size"]).start()
+    try:
+        # Seul l'en-tête du conteneur est lu pour obtenir la durée et les flux
+        media = probe_media(proxy.url)
+        total_duration = media.duration
+    except (RuntimeError, ValueError, KeyError, OSError) as e:
+        print(f"Sonde distante impossible, téléchargement complet: {e}")
+        proxy.stop()
+        return None
+
+    if needs_packet_index(media, encode_mode, audio_copy):
+        print("Index des paquets nécessaire (smart cut ou copie audio), téléchargement complet")
+        proxy.stop()
+        return None
+
+    # Mêmes segments que ceux que le handler encodera
+    keeps = valid_segments(invert_cuts_to_keeps(cuts, total_duration, min_gap=min_gap))
+    kept = sum(segment['end'] - segment['start'] for segment in keeps)
+    kept_ratio = kept / total_duration if total_duration else 1
+    print(f"Part gardée de la source: {kept_ratio:.1%} en {len(keeps)} segments")
+
+    if fetch_mode == 'partial':
+        print(f"Lecture partielle via proxy Range ({info['size']} octets côté source)")
+        return proxy
+    if len(keeps) > MAX_SEEK_SEGMENTS:
+        # Une entrée ffmpeg par segment : au-delà du seuil, le téléchargement complet est moins coûteux
+        print(f"Trop de segments pour la lecture partielle (> {MAX_SEEK_SEGMENTS}), téléchargement complet")
+    elif kept_ratio <= PARTIAL_FETCH_MAX_RATIO:
+        print(f"Lecture partielle via proxy Range ({info['size']} octets côté source)")
+        return proxy
+
+    proxy.stop()
+    return None
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from dropbox_upload import retryable_errors
+from intervals import normalize_cuts
+from lazy import lazy_import
+from source_cache import _FileLock
+
+dropbox = lazy_import('dropbox')
+
+RESULT_STORE_DIR = os.environ.get('RESULT_STORE_DIR', '/tmp/result_store')
+
+# Durée de validité d'un résultat mémorisé
+RESULT_TTL_SECONDS = int(os.environ.get('RESULT_TTL_SECONDS', 24 * 3600))
+
+
+def job_key(source_info, video_url, cuts, options):
+    """
+    Hash du job normalisé : identité de la source (URL + ETag/Last-Modified),
+    cuts fusionnés et options qui changent le fichier produit ou sa destination.
+    None si la source n'a aucun validateur (son contenu peut changer sous la même URL).
+    """
+    if not source_info.get('etag') and not source_info.get('last_modified'):
+        return None
+    spec = {
+        "url": video_url,
+        "etag": source_info.get('etag'),
+        "last_modified": source_info.get('last_modified'),
+        # Arrondi à la microseconde : deux JSON équivalents donnent la même clé
+        "cuts": [(round(start, 6), round(end, 6)) for start, end in normalize_cuts(cuts)],
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+class ResultStore:
+    """
+    Résultats des jobs déjà traités, un fichier JSON par clé avec date d'expiration.
+    Le verrou par clé sérialise les doublons simultanés : le second attend puis réutilise le résultat.
+    """
+
+    def __init__(self, root=RESULT_STORE_DIR, ttl=RESULT_TTL_SECONDS):
+        self.root = root
+        self.ttl = ttl
+        for sub in ('results', 'locks', 'tmp'):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, 'results', key + '.json')
+
+    def lock(self, key):
+        return _FileLock(os.path.join(self.root, 'locks', key + '.lock'))
+
+    def lookup(self, key):
+        try:
+            with open(self._path(key)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get('expires', 0) < time.time():
+            self.discard(key)
+            return None
+        return record
+
+    def lookup_verified(self, dbx, key):
+        """Résultat mémorisé dont le fichier existe toujours dans Dropbox (un appel get_metadata)"""
+        record = self.lookup(key)
+        if record is None:
+            return None
+        try:
+            metadata = dbx.files_get_metadata(record['result']['dropbox_path'])
+        except dropbox.exceptions.ApiError:
+            metadata = None
+        except retryable_errors() as e:
+            # Vérification impossible : le job est retraité, le résultat mémorisé est gardé
+            print(f"Vérification du résultat mémorisé impossible: {e}")
+            return None
+        # L'id change si le fichier a été supprimé puis recréé, ou s'il s'agit d'un autre compte
+        if metadata is None or getattr(metadata, 'id', None) != record['file_id']:
+            print("Résultat mémorisé obsolète: fichier supprimé ou remplacé dans Dropbox")
+            self.discard(key)
+            return None
+        return record['result']
+
+    def store(self, key, result, file_id):
+        record = {"result": result, "file_id": file_id, "expires": time.time() + self.ttl}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._path(key))
+
+    def discard(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def purge_expired(self):
+        """Supprime les résultats expirés et leurs verrous libres (appelé après chaque enregistrement)"""
+        deadline = time.time() - self.ttl
+        for sub, suffix in (('results', '.json'), ('locks', '.lock')):
+            directory = os.path.join(self.root, sub)
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    if os.stat(path).st_mtime >= deadline:
+                        continue
+                except OSError:
+                    continue
+                if sub == 'results':
+                    self.discard(name[:-len(suffix)])
+                    continue
+                # Verrou tenu par un job en cours : on ne le touche pas
+                lock = _FileLock(path, blocking=False)
+                if lock.acquire():
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                    lock.release()
+
+
+_result_store = None
+
+
+def get_result_store():
+    """Instance unique du store pour le worker"""
+    global _result_store
+    if _result_store is None:
+        _result_store = ResultStore()
+    return _result_store
@@ -0,0 +1,183 @@
+import bisect
+import os
+
+from ffmpeg_tools import run_command, probe_json, concat_demux
+from filter_graph import build_filter_graph, valid_segments
+
+# Codecs vidéo que l'on sait ré-encoder avec des paramètres compatibles
+SMART_CUT_ENCODERS = {
+    'h264': 'libx264',
+}
+
+# Profils 8 bits 4:2:0 uniquement : les morceaux ré-encodés doivent rester concaténables
+# avec les GOP copiés (High 10, 4:2:2 et 4:4:4 ne le sont pas de façon fiable)
+X264_PROFILES = {
+    'Baseline': 'baseline',
+    'Constrained Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+}
+
+SMART_CUT_PIX_FMTS = {'yuv420p', 'yuvj420p'}
+
+# En dessous de cette durée un morceau est considéré comme vide
+MIN_PIECE_DURATION = 0.001
+
+
+class SmartCutUnsupported(Exception):
+    """Le fichier ne permet pas la découpe intelligente (codec, absence de keyframes...)"""
+
+
+def probe_keyframes(input_path):
+    """Retourne la liste triée des timestamps des keyframes du premier flux vidéo"""
+    cmd = [
+        'ffprobe', '-v', 'quiet', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', input_path
+    ]
+    keyframes = []
+    for line in run_command(cmd).splitlines():
+        parts = line.strip().split(',')
+        if len(parts) < 2 or 'K' not in parts[1]:
+            continue
+        try:
+            keyframes.append(float(parts[0]))
+        except ValueError:
+            continue
+    keyframes.sort()
+    return keyframes
+
+
+def probe_video_params(input_path):
+    """Récupère les paramètres du flux vidéo nécessaires pour un ré-encodage compatible"""
+    data = probe_json(
+        input_path, '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,profile,level,pix_fmt,width,height,avg_frame_rate'
+    )
+    if not data.get('streams'):
+        raise SmartCutUnsupported("Aucun flux vidéo")
+    return data['streams'][0]
+
+
+def encoder_args(params):
+    """Arguments d'encodage reproduisant le codec, profil et format de pixel de la source"""
+    encoder = SMART_CUT_ENCODERS.get(params.get('codec_name'))
+    if not encoder:
+        raise SmartCutUnsupported(f"Codec non supporté pour smart cut: {params.get('codec_name')}")
+
+    profile = X264_PROFILES.get(params.get('profile'))
+    if not profile:
+        raise SmartCutUnsupported(f"Profil non supporté pour smart cut: {params.get('profile')}")
+    if params.get('pix_fmt') not in SMART_CUT_PIX_FMTS:
+        raise SmartCutUnsupported(f"Format de pixel non supporté pour smart cut: {params.get('pix_fmt')}")
+
+    args = ['-c:v', encoder, '-profile:v', profile]
+    level = params.get('level')
+    if isinstance(level, int) and level > 0:
+        args += ['-level:v', f"{level / 10:.1f}"]
+    args += ['-pix_fmt', params['pix_fmt']]
+    if params.get('avg_frame_rate') and params['avg_frame_rate'] != '0/0':
+        args += ['-r', params['avg_frame_rate']]
+    return args
+
+
+def plan_smart_cut(segments, keyframes):
+    """Découpe chaque segment en morceaux 'encode' (GOP partiels) et 'copy' (GOP complets)"""
+    pieces = []
+    for segment in segments:
+        start, end = segment['start'], segment['end']
+        # Première keyframe >= start et dernière keyframe <= end
+        first_idx = bisect.bisect_left(keyframes, start)
+        last_idx = bisect.bisect_right(keyframes, end) - 1
+        first_kf = keyframes[first_idx] if first_idx < len(keyframes) else None
+        last_kf = keyframes[last_idx] if last_idx >= 0 else None
+
+        if first_kf is None or last_kf is None or last_kf - first_kf < MIN_PIECE_DURATION:
+            # Pas de GOP complet dans le segment : ré-encodage intégral
+            pieces.append({"mode": "encode", "start": start, "end": end})
+            continue
+
+        if first_kf - start >= MIN_PIECE_DURATION:
+            pieces.append({"mode": "encode", "start": start, "end": first_kf})
+        pieces.append({"mode": "copy", "start": first_kf, "end": last_kf})
+        if end - last_kf >= MIN_PIECE_DURATION:
+            pieces.append({"mode": "encode", "start": last_kf, "end": end})
+    return pieces
+
+
+def _render_piece(input_path, piece, piece_path, video_args):
+    duration = piece['end'] - piece['start']
+    cmd = ['ffmpeg', '-ss', str(piece['start']), '-i', input_path, '-t', str(duration), '-an']
+    if piece['mode'] == 'copy':
+        cmd += ['-c:v', 'copy', '-bsf:v', 'h264_mp4toannexb']
+    else:
+        cmd += video_args
+    cmd += ['-f', 'mpegts', '-y', piece_path]
+    run_command(cmd)
+
+
+def _render_audio(input_path, segments, audio_path):
+    graph = build_filter_graph(segments, False, True, script_dir=os.path.dirname(audio_path))
+    if graph is None:
+        raise SmartCutUnsupported("Tous les segments sont trop courts après filtrage")
+    try:
+        run_command(['ffmpeg', '-i', input_path] + graph['args'] + graph['maps'] + ['-c:a', 'aac', '-vn', '-y', audio_path])
+    finally:
+        if graph['script_path']:
+            os.unlink(graph['script_path'])
+
+
+def smart_cut(input_path, segments, output_path, work_dir, has_audio=True, media=None):
+    """
+    Découpe sans ré-encoder l'intérieur des segments : seuls les GOP partiels
+    aux bornes sont ré-encodés, le reste est copié puis joint par le demuxer concat.
+    Retourne les durées copiées et ré-encodées.
+    """
+    if media is not None and media.has_index and media.first_stream('video'):
+        # Sonde déjà faite par le handler : paramètres et keyframes sans nouvel appel ffprobe
+        params = media.first_stream('video')
+        keyframes = media.keyframes
+    else:
+        params = probe_video_params(input_path)
+        keyframes = probe_keyframes(input_path)
+    video_args = encoder_args(params)
+    if not keyframes:
+        raise SmartCutUnsupported("Aucune keyframe détectée")
+
+    # Mêmes segments pour la vidéo et l'audio (le graphe audio ignore les segments trop courts)
+    segments = valid_segments(segments)
+    if not segments:
+        raise SmartCutUnsupported("Tous les segments sont trop courts après filtrage")
+
+    pieces = plan_smart_cut(segments, keyframes)
+    print(f"Smart cut: {len(pieces)} morceaux pour {len(segments)} segments")
+
+    piece_paths = []
+    copied_seconds = 0.0
+    reencoded_seconds = 0.0
+    for i, piece in enumerate(pieces):
+        piece_path = os.path.join(work_dir, f"piece_{i:05d}.ts")
+        _render_piece(input_path, piece, piece_path, video_args)
+        piece_paths.append(piece_path)
+        if piece['mode'] == 'copy':
+            copied_seconds += piece['end'] - piece['start']
+        else:
+            reencoded_seconds += piece['end'] - piece['start']
+
+    list_path = os.path.join(work_dir, 'pieces.txt')
+    if has_audio:
+        audio_path = os.path.join(work_dir, 'audio.m4a')
+        _render_audio(input_path, segments, audio_path)
+        concat_demux(
+            piece_paths, list_path, output_path,
+            extra_inputs=[audio_path],
+            extra_args=['-map', '0:v', '-map', '1:a', '-c', 'copy']
+        )
+    else:
+        concat_demux(piece_paths, list_path, output_path)
+
+    print(f"Smart cut terminé: {copied_seconds:.2f}s copiées, {reencoded_seconds:.2f}s ré-encodées")
+    return {
+        "pieces": len(pieces),
+        "copied_seconds": round(copied_seconds, 3),
+        "reencoded_seconds": round(reencoded_seconds, 3),
+    }
@@ -0,0 +1,260 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from downloader import download_file, probe_source, DEFAULT_CONNECTIONS
+
+SOURCE_CACHE_DIR = os.environ.get('SOURCE_CACHE_DIR', '/tmp/source_cache')
+
+# Budget disque du cache, au-delà les entrées les moins récemment utilisées sont supprimées.
+# Sans budget fixe, le cache peut occuper cette fraction de l'espace qui lui est disponible
+# (espace libre + ce qu'il occupe déjà), le reste étant laissé aux workspaces d'encodage.
+SOURCE_CACHE_MAX_BYTES = int(os.environ['SOURCE_CACHE_MAX_BYTES']) if os.environ.get('SOURCE_CACHE_MAX_BYTES') else None
+SOURCE_CACHE_DISK_FRACTION = float(os.environ.get('SOURCE_CACHE_DISK_FRACTION', 0.5))
+
+HASH_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(HASH_BUFFER_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class _FileLock:
+    """Verrou fcntl sur un fichier, partagé entre processus et threads (un descripteur par acquisition)"""
+
+    def __init__(self, path, shared=False, blocking=True):
+        self.path = path
+        self.mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            self.mode |= fcntl.LOCK_NB
+        self.fd = None
+
+    def acquire(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.fd, self.mode)
+        except OSError:
+            os.close(self.fd)
+            self.fd = None
+            return False
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class CacheEntry:
+    """Fichier source en cache, épinglé (verrou partagé) tant que le job l'utilise"""
+
+    def __init__(self, cache, digest):
+        self.cache = cache
+        self.digest = digest
+        self.path = cache._object_path(digest)
+        # Sidecar de sonde (format, flux, index des keyframes) réutilisé par les jobs suivants
+        self.index_path = self.path + '.index'
+        self._pin = _FileLock(self.path + '.lock', shared=True)
+        self._pin.acquire()
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def touch(self):
+        now = time.time()
+        os.utime(self.path, (now, now))
+
+    def release(self):
+        self._pin.release()
+
+
+class SourceCache:
+    """
+    Cache disque des sources téléchargées et de leur sonde, persistant entre les jobs d'un worker chaud.
+    Clé : URL + ETag/Last-Modified ; les fichiers sont stockés par hash de contenu,
+    donc deux URLs servant le même fichier ne l'occupent qu'une fois.
+    """
+
+    def __init__(self, root=SOURCE_CACHE_DIR, max_bytes=SOURCE_CACHE_MAX_BYTES, disk_fraction=SOURCE_CACHE_DISK_FRACTION):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.disk_fraction = disk_fraction
+        for sub in ('objects', 'index', 'locks', 'tmp'):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest)
+
+    def _index_path(self, key):
+        return os.path.join(self.root, 'index', key + '.json')
+
+    def _write_json(self, path, payload):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def cache_key(url, etag=None, last_modified=None):
+        """Clé de cache, None si la source n'a aucun validateur (impossible de réutiliser sans télécharger)"""
+        if not etag and not last_modified:
+            return None
+        return hashlib.sha256(f"{url}\n{etag or ''}\n{last_modified or ''}".encode()).hexdigest()
+
+    @staticmethod
+    def cacheable(source_info):
+        """Une source sans ETag ni Last-Modified ne serait jamais retrouvée : elle va dans le workspace du job"""
+        return bool(source_info["etag"] or source_info["last_modified"])
+
+    def _lookup(self, key):
+        try:
+            with open(self._index_path(key)) as f:
+                digest = json.load(f)['digest']
+        except (OSError, ValueError, KeyError):
+            return None
+        if not os.path.exists(self._object_path(digest)):
+            return None
+        return digest
+
+    def _store(self, download_path):
+        """
+        Range le fichier téléchargé sous son hash de contenu (dédupliqué) et retourne l'entrée épinglée.
+        L'épinglage se fait sous le verrou des objets : une éviction concurrente ne peut pas la supprimer.
+        """
+        digest = _file_digest(download_path)
+        object_path = self._object_path(digest)
+        with _FileLock(os.path.join(self.root, 'locks', 'objects.lock')):
+            if os.path.exists(object_path):
+                os.unlink(download_path)
+            else:
+                os.replace(download_path, object_path)
+            return CacheEntry(self, digest)
+
+    def _pin_hit(self, key):
+        """Épingle l'entrée de la clé si elle est en cache : (entrée, statistiques) ou None"""
+        digest = self._lookup(key) if key else None
+        if not digest:
+            return None
+        entry = CacheEntry(self, digest)
+        if not os.path.exists(entry.path):
+            # Évincée entre la lecture de l'index et l'épinglage
+            entry.release()
+            return None
+        entry.touch()
+        print(f"Cache source: hit ({entry.size} octets non téléchargés)")
+        return entry, {"hit": True, "bytes_saved": entry.size, "download": None}
+
+    def lookup(self, url, source_info):
+        """Entrée épinglée et statistiques si la source est déjà en cache, sans rien télécharger, sinon None"""
+        return self._pin_hit(self.cache_key(url, source_info["etag"], source_info["last_modified"]))
+
+    def acquire(self, url, connections=DEFAULT_CONNECTIONS, source_info=None):
+        """
+        Retourne (entrée épinglée, statistiques). En cas de hit, ni téléchargement ni sonde.
+        La source doit être cacheable (voir cacheable). L'appelant doit appeler entry.release() à la fin du job.
+        """
+        info = source_info or probe_source(url)
+        key = self.cache_key(url, info["etag"], info["last_modified"])
+        if key is None:
+            raise ValueError("Source sans ETag ni Last-Modified : pas de mise en cache")
+        key_lock = _FileLock(os.path.join(self.root, 'locks', key + '.lock'))
+
+        # Un seul téléchargement à la fois par clé : les jobs concurrents attendent puis font un hit
+        with key_lock:
+            hit = self._pin_hit(key)
+            if hit:
+                return hit
+
+            fd, download_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'), suffix='.download')
+            os.close(fd)
+            try:
+                download_stats = download_file(url, download_path, connections=connections, source_info=info)
+                entry = self._store(download_path)
+            finally:
+                if os.path.exists(download_path):
+                    os.unlink(download_path)
+            self._write_json(self._index_path(key), {"digest": entry.digest, "url": url})
+            entry.touch()
+
+        print("Cache source: miss")
+        self.evict(keep=entry.digest)
+        return entry, {"hit": False, "bytes_saved": 0, "download": download_stats}
+
+    def budget(self, cached_bytes):
+        """Budget fixe s'il est configuré, sinon une fraction de l'espace disque disponible pour le cache"""
+        if self.max_bytes is not None:
+            return self.max_bytes
+        return int(self.disk_fraction * (shutil.disk_usage(self.root).free + cached_bytes))
+
+    def evict(self, keep=None):
+        """Supprime les entrées les moins récemment utilisées tant que le budget disque est dépassé"""
+        objects_dir = os.path.join(self.root, 'objects')
+        with _FileLock(os.path.join(self.root, 'locks', 'objects.lock')):
+            entries = []
+            for name in os.listdir(objects_dir):
+                if name.endswith(('.lock', '.index', '.tmp')):
+                    continue
+                path = os.path.join(objects_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            max_bytes = self.budget(total)
+            for _, size, digest in sorted(entries):
+                if total <= max_bytes:
+                    break
+                if digest == keep:
+                    continue
+                # Entrée épinglée par un job en cours : on ne la touche pas
+                lock = _FileLock(self._object_path(digest) + '.lock', blocking=False)
+                if not lock.acquire():
+                    continue
+                try:
+                    for suffix in ('', '.index'):
+                        try:
+                            os.unlink(self._object_path(digest) + suffix)
+                        except OSError:
+                            pass
+                    total -= size
+                    print(f"Cache source: éviction de {digest[:12]} ({size} octets)")
+                finally:
+                    lock.release()
+                    try:
+                        os.unlink(self._object_path(digest) + '.lock')
+                    except OSError:
+                        pass
+
+
+
+_source_cache = None
+
+
+def get_source_cache():
+    """Instance unique du cache pour le worker (réutilisée entre les invocations)"""
+    global _source_cache
+    if _source_cache is None:
+        _source_cache = SourceCache()
+    return _source_cache
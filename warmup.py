@@ -0,0 +1,33 @@
+import subprocess
+import threading
+import time
+
+from dropbox_upload import warm_up_session
+from logs import debug
+
+# Résultat du warm-up, exposé pour les mesures de démarrage
+warmup_stats = {}
+
+
+def _warm_up():
+    started = time.monotonic()
+    # Premier lancement : binaires et bibliothèques chargés dans le cache de pages
+    for tool in ('ffmpeg', 'ffprobe'):
+        try:
+            subprocess.run([tool, '-version'], capture_output=True, timeout=30)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"Warm-up {tool} impossible: {e}")
+    warmup_stats['ffmpeg_seconds'] = round(time.monotonic() - started, 3)
+
+    dropbox_started = time.monotonic()
+    warm_up_session()
+    warmup_stats['dropbox_seconds'] = round(time.monotonic() - dropbox_started, 3)
+    warmup_stats['seconds'] = round(time.monotonic() - started, 3)
+    debug(f"Warm-up terminé: {warmup_stats}")
+
+
+def start_warmup():
+    """Lance le warm-up en arrière-plan, pendant le démarrage de RunPod"""
+    thread = threading.Thread(target=_warm_up, name='warmup', daemon=True)
+    thread.start()
+    return thread